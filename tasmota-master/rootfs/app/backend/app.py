@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import json
 import asyncio
@@ -52,7 +53,7 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 # Initialize services
 config_manager = ConfigManager()
 device_manager = DeviceManager(config_manager)
-template_manager = TemplateManager()
+template_manager = TemplateManager(device_manager)
 mqtt_client = MQTTClient(config_manager, device_manager)
 device_discovery = DeviceDiscovery(device_manager, mqtt_client)
 
@@ -279,7 +280,10 @@ def stop_discovery():
 @app.route('/api/templates')
 def get_templates():
     """Get device templates"""
-    templates = template_manager.get_all_templates()
+    # Full templates by default (the Templates page reads GPIO/settings from the listing);
+    # ?summary=true opts into the cheap projected columns
+    full = request.args.get('summary', 'false').lower() != 'true'
+    templates = template_manager.get_all_templates(full=full)
     return jsonify({
         'templates': templates,
         'count': len(templates)
@@ -585,7 +589,8 @@ def download_firmware(firmware_id):
 def get_firmware_analytics():
     """Get firmware analytics data"""
     try:
-        analytics_data = analytics_engine.get_analytics_dashboard_data()
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        analytics_data = analytics_engine.get_analytics_dashboard_data(refresh=refresh)
         return jsonify(analytics_data)
     except Exception as e:
         logger.error(f"Firmware analytics error: {e}")
@@ -866,6 +871,13 @@ def backup_device_config(device_id):
         if not device:
             return jsonify({'success': False, 'error': 'Device not found'}), 404
         
+        if request.args.get('format') == 'gzip':
+            blob = device_config_service.backup_device_config_blob(device.get('ip'))
+            if not blob:
+                return jsonify({'success': False, 'error': 'Failed to backup device configuration'}), 500
+            return send_file(io.BytesIO(blob), mimetype='application/gzip', as_attachment=True,
+                             download_name=f'{device_id}_backup.json.gz')
+        
         backup_data = device_config_service.backup_device_config(device.get('ip'))
         
         if backup_data:
@@ -3,16 +3,38 @@ Device Configuration Service - Tasmotizer-like functionality
 Provides device configuration capabilities similar to the Windows Tasmotizer app
 """
 
+import asyncio
+import gzip
 import logging
-import json
+import re
+import threading
 import time
 import urllib.parse
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 import requests
+import aiohttp
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.json_codec import dumps as _dumps, dumps_bytes as _dumps_bytes, loads as _loads
 
 logger = logging.getLogger(__name__)
 
+# Raw commands: 1-100 chars of alphanumerics, whitespace, underscore and percent
+_CMD_RE = re.compile(r'^[a-zA-Z0-9\s_%]{1,100}\Z')
+
+
+@lru_cache(maxsize=512)
+def _q(value: str) -> str:
+    """Percent-encode a command name or non-secret argument; memoized for repeated values
+    
+    Credentials go through urllib.parse.quote directly so they never sit in the cache.
+    """
+    return urllib.parse.quote(value, safe='')
+
+
 class DeviceConfigService:
     """Service for configuring Tasmota devices like Tasmotizer"""
     
@@ -20,6 +42,17 @@ class DeviceConfigService:
         self.device_manager = device_manager
         self.mqtt_client = mqtt_client
         
+        # Shared HTTP session so repeat calls to a device reuse keep-alive sockets
+        self._http = requests.Session()
+        self._http.headers['Connection'] = 'keep-alive'
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(total=2, backoff_factor=0.2,
+                              status_forcelist=[500, 502, 503, 504])
+        )
+        self._http.mount('http://', adapter)
+        
         # Common Tasmota configuration templates
         self.device_templates = {
             'sonoff_basic': {
@@ -48,6 +81,17 @@ class DeviceConfigService:
             }
         }
         
+        # Template payloads never change, so encode the command argument once
+        self._template_urls = {
+            key: _q(_dumps({
+                'NAME': template['name'],
+                'GPIO': template['gpio'],
+                'FLAG': template['flag'],
+                'BASE': template['base']
+            }))
+            for key, template in self.device_templates.items()
+        }
+        
         # WiFi configuration presets
         self.wifi_presets = {
             'home': {'ssid': '', 'password': ''},
@@ -55,219 +99,300 @@ class DeviceConfigService:
             'mobile': {'ssid': '', 'password': ''}
         }
         
-    def get_device_info(self, device_ip: str) -> Optional[Dict[str, Any]]:
-        """Get comprehensive device information via HTTP API"""
+        # Short-lived cache of parsed Status 0 responses, keyed by device IP
+        self.device_info_ttl = 30
+        self._info_cache: Dict[str, tuple] = {}
+        self._info_lock = threading.Lock()
+        
+    def get_device_info(self, device_ip: str,
+                        status_data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Get comprehensive device information, served from cache when fresh
+        
+        Pass an already fetched ``Status 0`` response as status_data to skip the HTTP call.
+        """
+        now = time.monotonic()
+        if status_data is None:
+            with self._info_lock:
+                cached = self._info_cache.get(device_ip)
+                if cached and cached[0] > now:
+                    return cached[1]
+            
+            status_data = self._fetch_status0(device_ip)
+            if status_data is None:
+                return None
+        
+        try:
+            device_info = self._parse_device_info(device_ip, status_data)
+        except Exception as e:
+            logger.error(f"Failed to get device info from {device_ip}: {e}")
+            return None
+        
+        with self._info_lock:
+            self._info_cache[device_ip] = (now + self.device_info_ttl, device_info)
+        return device_info
+    
+    def _invalidate_device_info(self, device_ip: str):
+        """Drop cached device information after a state-changing command"""
+        with self._info_lock:
+            self._info_cache.pop(device_ip, None)
+    
+    def _fetch_status0(self, device_ip: str) -> Optional[Dict[str, Any]]:
+        """Fetch the raw ``Status 0`` response, which covers Status/StatusNET/StatusSTS"""
         try:
-            # Get basic status
             status_url = f"http://{device_ip}/cm?cmnd=Status%200"
-            response = requests.get(status_url, timeout=10)
+            response = self._http.get(status_url, timeout=10)
             
             if response.status_code == 200:
-                status_data = response.json()
-                
-                # Parse device information
-                device_info = {
-                    'ip': device_ip,
-                    'status': status_data,
-                    'online': True,
-                    'last_check': datetime.now().isoformat()
-                }
-                
-                # Extract key information
-                if 'Status' in status_data:
-                    status = status_data['Status']
-                    device_info.update({
-                        'device_name': status.get('DeviceName', 'Unknown'),
-                        'friendly_name': status.get('FriendlyName', [''])[0],
-                        'topic': status.get('Topic', ''),
-                        'firmware_version': status.get('Version', ''),
-                        'hardware': status.get('Hardware', ''),
-                        'build_date': status.get('BuildDateTime', '')
-                    })
-                
-                if 'StatusNET' in status_data:
-                    net = status_data['StatusNET']
-                    device_info.update({
-                        'hostname': net.get('Hostname', ''),
-                        'mac': net.get('Mac', ''),
-                        'ip_address': net.get('IPAddress', ''),
-                        'gateway': net.get('Gateway', ''),
-                        'dns': net.get('DNSServer', ''),
-                        'wifi_ssid': net.get('SSId', ''),
-                        'wifi_channel': net.get('Channel', 0),
-                        'wifi_rssi': net.get('RSSI', 0)
-                    })
-                
-                if 'StatusSTS' in status_data:
-                    sts = status_data['StatusSTS']
-                    device_info.update({
-                        'uptime': sts.get('Uptime', ''),
-                        'heap_free': sts.get('Heap', 0),
-                        'sleep_mode': sts.get('SleepMode', ''),
-                        'wifi_signal': sts.get('Wifi', {}).get('Signal', 0),
-                        'power_state': sts.get('POWER', 'OFF')
-                    })
-                
-                return device_info
-                
+                return _loads(response.content)
         except Exception as e:
             logger.error(f"Failed to get device info from {device_ip}: {e}")
-            return None
+        return None
+    
+    def _parse_device_info(self, device_ip: str, status_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Derive the device info dict from a ``Status 0`` response"""
+        # Parse device information
+        device_info = {
+            'ip': device_ip,
+            'status': status_data,
+            'online': True,
+            'last_check': datetime.now().isoformat()
+        }
+        
+        # Extract key information
+        if 'Status' in status_data:
+            status = status_data['Status']
+            device_info.update({
+                'device_name': status.get('DeviceName', 'Unknown'),
+                'friendly_name': status.get('FriendlyName', [''])[0],
+                'topic': status.get('Topic', ''),
+                'firmware_version': status.get('Version', ''),
+                'hardware': status.get('Hardware', ''),
+                'build_date': status.get('BuildDateTime', '')
+            })
+        
+        if 'StatusNET' in status_data:
+            net = status_data['StatusNET']
+            device_info.update({
+                'hostname': net.get('Hostname', ''),
+                'mac': net.get('Mac', ''),
+                'ip_address': net.get('IPAddress', ''),
+                'gateway': net.get('Gateway', ''),
+                'dns': net.get('DNSServer', ''),
+                'wifi_ssid': net.get('SSId', ''),
+                'wifi_channel': net.get('Channel', 0),
+                'wifi_rssi': net.get('RSSI', 0)
+            })
+        
+        if 'StatusSTS' in status_data:
+            sts = status_data['StatusSTS']
+            device_info.update({
+                'uptime': sts.get('Uptime', ''),
+                'heap_free': sts.get('Heap', 0),
+                'sleep_mode': sts.get('SleepMode', ''),
+                'wifi_signal': sts.get('Wifi', {}).get('Signal', 0),
+                'power_state': sts.get('POWER', 'OFF')
+            })
+        
+        return device_info
+    
+    def _new_async_session(self) -> aiohttp.ClientSession:
+        """Create an aiohttp session for a single configuration pipeline"""
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300)
+        )
+    
+    async def _send_commands(self, session: aiohttp.ClientSession, urls: List[str],
+                             timeout: float = 10, return_exceptions: bool = False) -> List[Any]:
+        """Send independent device commands concurrently, returning per-command success
+        
+        With return_exceptions=True a failed request yields its exception instead of
+        aborting the others.
+        """
+        async def _get(url: str) -> bool:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                await response.read()
+                return response.status == 200
+        
+        return list(await asyncio.gather(*(_get(url) for url in urls),
+                                         return_exceptions=return_exceptions))
     
     def configure_wifi(self, device_ip: str, ssid: str, password: str, 
                       ap_ssid: str = None, ap_password: str = None) -> Dict[str, Any]:
         """Configure WiFi settings on device"""
+        self._invalidate_device_info(device_ip)
         try:
-            result = {'success': False, 'messages': []}
-            
-            # Set WiFi credentials - URL encode parameters to prevent injection
-            encoded_ssid = urllib.parse.quote(ssid)
-            encoded_password = urllib.parse.quote(password)
-            wifi1_cmd = f"http://{device_ip}/cm?cmnd=Wifi1%20{encoded_ssid}%20{encoded_password}"
-            response = requests.get(wifi1_cmd, timeout=10)
+            return asyncio.run(self._configure_wifi_async(device_ip, ssid, password,
+                                                          ap_ssid, ap_password))
+        except Exception as e:
+            logger.error(f"Failed to configure WiFi on {device_ip}: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    async def _configure_wifi_async(self, device_ip: str, ssid: str, password: str,
+                                    ap_ssid: str = None, ap_password: str = None) -> Dict[str, Any]:
+        """Set station/AP credentials concurrently, then restart once both are applied"""
+        result = {'success': False, 'messages': []}
+        
+        # Set WiFi credentials - URL encode parameters to prevent injection
+        encoded_ssid = _q(ssid)
+        encoded_password = urllib.parse.quote(password, safe='')
+        cmds = [f"http://{device_ip}/cm?cmnd=Wifi1%20{encoded_ssid}%20{encoded_password}"]
+        
+        # Configure AP mode if provided
+        if ap_ssid and ap_password:
+            encoded_ap_ssid = _q(ap_ssid)
+            encoded_ap_password = urllib.parse.quote(ap_password, safe='')
+            cmds.append(f"http://{device_ip}/cm?cmnd=Wifi2%20{encoded_ap_ssid}%20{encoded_ap_password}")
+        
+        async with self._new_async_session() as session:
+            statuses = await self._send_commands(session, cmds)
             
-            if response.status_code == 200:
+            if statuses[0]:
                 result['messages'].append("WiFi credentials set successfully")
-                
-                # Configure AP mode if provided
-                if ap_ssid and ap_password:
-                    encoded_ap_ssid = urllib.parse.quote(ap_ssid)
-                    encoded_ap_password = urllib.parse.quote(ap_password)
-                    ap_cmd = f"http://{device_ip}/cm?cmnd=Wifi2%20{encoded_ap_ssid}%20{encoded_ap_password}"
-                    ap_response = requests.get(ap_cmd, timeout=10)
-                    if ap_response.status_code == 200:
-                        result['messages'].append("AP credentials set successfully")
+                if len(statuses) > 1 and statuses[1]:
+                    result['messages'].append("AP credentials set successfully")
                 
                 # Restart to apply settings
                 restart_cmd = f"http://{device_ip}/cm?cmnd=Restart%201"
-                restart_response = requests.get(restart_cmd, timeout=5)
-                if restart_response.status_code == 200:
+                if (await self._send_commands(session, [restart_cmd], timeout=5))[0]:
                     result['messages'].append("Device restarted to apply settings")
                     result['success'] = True
                     result['restart_initiated'] = True
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Failed to configure WiFi on {device_ip}: {e}")
-            return {'success': False, 'error': str(e)}
+        
+        return result
     
     def configure_mqtt(self, device_ip: str, mqtt_host: str, mqtt_port: int = 1883,
                       mqtt_user: str = '', mqtt_pass: str = '', topic: str = '') -> Dict[str, Any]:
         """Configure MQTT settings on device"""
+        self._invalidate_device_info(device_ip)
         try:
-            result = {'success': False, 'messages': []}
-            
-            # Set MQTT host - URL encode parameters to prevent injection
-            encoded_host = urllib.parse.quote(mqtt_host)
-            host_cmd = f"http://{device_ip}/cm?cmnd=MqttHost%20{encoded_host}"
-            response = requests.get(host_cmd, timeout=10)
-            
-            if response.status_code == 200:
-                result['messages'].append(f"MQTT host set to {mqtt_host}")
-                
-                # Set MQTT port
-                port_cmd = f"http://{device_ip}/cm?cmnd=MqttPort%20{mqtt_port}"
-                port_response = requests.get(port_cmd, timeout=10)
-                if port_response.status_code == 200:
-                    result['messages'].append(f"MQTT port set to {mqtt_port}")
-                
-                # Set MQTT credentials if provided
-                if mqtt_user:
-                    encoded_user = urllib.parse.quote(mqtt_user)
-                    user_cmd = f"http://{device_ip}/cm?cmnd=MqttUser%20{encoded_user}"
-                    user_response = requests.get(user_cmd, timeout=10)
-                    if user_response.status_code == 200:
-                        result['messages'].append("MQTT user set")
-                        
-                        if mqtt_pass:
-                            encoded_pass = urllib.parse.quote(mqtt_pass)
-                            pass_cmd = f"http://{device_ip}/cm?cmnd=MqttPassword%20{encoded_pass}"
-                            pass_response = requests.get(pass_cmd, timeout=10)
-                            if pass_response.status_code == 200:
-                                result['messages'].append("MQTT password set")
-                
-                # Set topic if provided - URL encode to prevent injection
-                if topic:
-                    encoded_topic = urllib.parse.quote(topic)
-                    topic_cmd = f"http://{device_ip}/cm?cmnd=Topic%20{encoded_topic}"
-                    topic_response = requests.get(topic_cmd, timeout=10)
-                    if topic_response.status_code == 200:
-                        result['messages'].append(f"Device topic set to {topic}")
-                
-                result['success'] = True
-            
-            return result
-            
+            return asyncio.run(self._configure_mqtt_async(device_ip, mqtt_host, mqtt_port,
+                                                          mqtt_user, mqtt_pass, topic))
         except Exception as e:
             logger.error(f"Failed to configure MQTT on {device_ip}: {e}")
             return {'success': False, 'error': str(e)}
     
+    async def _configure_mqtt_async(self, device_ip: str, mqtt_host: str, mqtt_port: int = 1883,
+                                    mqtt_user: str = '', mqtt_pass: str = '',
+                                    topic: str = '') -> Dict[str, Any]:
+        """Set the MQTT host, then the remaining settings concurrently
+        
+        The password is only sent once MqttUser succeeded; per-command outcomes are
+        returned under 'commands'.
+        """
+        result = {'success': False, 'messages': [], 'commands': {}}
+        
+        # URL encode parameters to prevent injection
+        encoded_host = _q(mqtt_host)
+        host_cmd = f"http://{device_ip}/cm?cmnd=MqttHost%20{encoded_host}"
+        cmds = {'port': f"http://{device_ip}/cm?cmnd=MqttPort%20{mqtt_port}"}
+        
+        # Set MQTT credentials if provided
+        if mqtt_user:
+            encoded_user = urllib.parse.quote(mqtt_user, safe='')
+            cmds['user'] = f"http://{device_ip}/cm?cmnd=MqttUser%20{encoded_user}"
+        
+        # Set topic if provided
+        if topic:
+            encoded_topic = _q(topic)
+            cmds['topic'] = f"http://{device_ip}/cm?cmnd=Topic%20{encoded_topic}"
+        
+        async with self._new_async_session() as session:
+            # Nothing else is sent unless the host was accepted
+            result['commands']['host'] = (await self._send_commands(session, [host_cmd]))[0]
+            if not result['commands']['host']:
+                return result
+            result['messages'].append(f"MQTT host set to {mqtt_host}")
+            
+            responses = await self._send_commands(session, list(cmds.values()),
+                                                  return_exceptions=True)
+            for key, response in zip(cmds, responses):
+                if isinstance(response, Exception):
+                    logger.error(f"MQTT {key} command failed on {device_ip}: {response}")
+                result['commands'][key] = response is True
+            
+            if mqtt_user and mqtt_pass and result['commands']['user']:
+                encoded_pass = urllib.parse.quote(mqtt_pass, safe='')
+                pass_cmd = f"http://{device_ip}/cm?cmnd=MqttPassword%20{encoded_pass}"
+                try:
+                    result['commands']['pass'] = (await self._send_commands(session, [pass_cmd]))[0]
+                except Exception as e:
+                    logger.error(f"MQTT pass command failed on {device_ip}: {e}")
+                    result['commands']['pass'] = False
+        
+        statuses = result['commands']
+        if statuses['port']:
+            result['messages'].append(f"MQTT port set to {mqtt_port}")
+        if statuses.get('user'):
+            result['messages'].append("MQTT user set")
+            if statuses.get('pass'):
+                result['messages'].append("MQTT password set")
+        if statuses.get('topic'):
+            result['messages'].append(f"Device topic set to {topic}")
+        
+        result['success'] = True
+        return result
+    
     def apply_template(self, device_ip: str, template_name: str) -> Dict[str, Any]:
         """Apply a device template (GPIO configuration)"""
+        self._invalidate_device_info(device_ip)
         try:
             if template_name not in self.device_templates:
                 return {'success': False, 'error': f'Template {template_name} not found'}
             
-            template = self.device_templates[template_name]
-            result = {'success': False, 'messages': []}
-            
-            # Create template command
-            template_data = {
-                'NAME': template['name'],
-                'GPIO': template['gpio'],
-                'FLAG': template['flag'],
-                'BASE': template['base']
-            }
-            
-            template_json = json.dumps(template_data)
-            template_cmd = f"http://{device_ip}/cm?cmnd=Template%20{template_json}"
-            
-            response = requests.get(template_cmd, timeout=10)
-            
-            if response.status_code == 200:
-                result['messages'].append(f"Template {template['name']} applied")
-                
-                # Activate the template
-                module_cmd = f"http://{device_ip}/cm?cmnd=Module%200"
-                module_response = requests.get(module_cmd, timeout=10)
-                
-                if module_response.status_code == 200:
-                    result['messages'].append("Template activated")
-                    
-                    # Restart to apply
-                    restart_cmd = f"http://{device_ip}/cm?cmnd=Restart%201"
-                    restart_response = requests.get(restart_cmd, timeout=5)
-                    if restart_response.status_code == 200:
-                        result['messages'].append("Device restarted")
-                        result['success'] = True
-                        result['restart_initiated'] = True
-            
-            return result
-            
+            return asyncio.run(self._apply_template_async(device_ip, template_name))
         except Exception as e:
             logger.error(f"Failed to apply template on {device_ip}: {e}")
             return {'success': False, 'error': str(e)}
     
+    async def _apply_template_async(self, device_ip: str, template_name: str) -> Dict[str, Any]:
+        """Apply template, activate and restart over one session (steps are order-dependent)"""
+        template = self.device_templates[template_name]
+        result = {'success': False, 'messages': []}
+        
+        # Create template command from the pre-encoded payload
+        encoded = self._template_urls[template_name]
+        template_cmd = f"http://{device_ip}/cm?cmnd=Template%20{encoded}"
+        module_cmd = f"http://{device_ip}/cm?cmnd=Module%200"
+        restart_cmd = f"http://{device_ip}/cm?cmnd=Restart%201"
+        
+        async with self._new_async_session() as session:
+            if not (await self._send_commands(session, [template_cmd]))[0]:
+                return result
+            result['messages'].append(f"Template {template['name']} applied")
+            
+            # Activate the template
+            if not (await self._send_commands(session, [module_cmd]))[0]:
+                return result
+            result['messages'].append("Template activated")
+            
+            # Restart to apply
+            if (await self._send_commands(session, [restart_cmd], timeout=5))[0]:
+                result['messages'].append("Device restarted")
+                result['success'] = True
+                result['restart_initiated'] = True
+        
+        return result
+    
     def configure_device_name(self, device_ip: str, device_name: str, 
                             friendly_name: str = None) -> Dict[str, Any]:
         """Configure device and friendly names"""
+        self._invalidate_device_info(device_ip)
         try:
             result = {'success': False, 'messages': []}
             
             # Set device name - URL encode to prevent injection
-            encoded_device_name = urllib.parse.quote(device_name)
+            encoded_device_name = _q(device_name)
             name_cmd = f"http://{device_ip}/cm?cmnd=DeviceName%20{encoded_device_name}"
-            response = requests.get(name_cmd, timeout=10)
+            response = self._http.get(name_cmd, timeout=10)
             
             if response.status_code == 200:
                 result['messages'].append(f"Device name set to {device_name}")
                 
                 # Set friendly name if provided
                 if friendly_name:
-                    encoded_friendly_name = urllib.parse.quote(friendly_name)
+                    encoded_friendly_name = _q(friendly_name)
                     friendly_cmd = f"http://{device_ip}/cm?cmnd=FriendlyName1%20{encoded_friendly_name}"
-                    friendly_response = requests.get(friendly_cmd, timeout=10)
+                    friendly_response = self._http.get(friendly_cmd, timeout=10)
                     if friendly_response.status_code == 200:
                         result['messages'].append(f"Friendly name set to {friendly_name}")
                 
@@ -283,7 +408,7 @@ class DeviceConfigService:
         """Get console log from device"""
         try:
             log_cmd = f"http://{device_ip}/cm?cmnd=SerialLog%202"
-            response = requests.get(log_cmd, timeout=10)
+            response = self._http.get(log_cmd, timeout=10)
             
             if response.status_code == 200:
                 # This would typically return log data
@@ -319,6 +444,13 @@ class DeviceConfigService:
             logger.error(f"Failed to backup device config from {device_ip}: {e}")
             return None
     
+    def backup_device_config_blob(self, device_ip: str) -> bytes:
+        """Backup device configuration as gzip-compressed JSON (empty on failure)"""
+        backup_data = self.backup_device_config(device_ip)
+        if not backup_data:
+            return b''
+        return gzip.compress(_dumps_bytes(backup_data), compresslevel=3)
+    
     def restore_device_config(self, device_ip: str, backup_data: Dict[str, Any]) -> Dict[str, Any]:
         """Restore device configuration from backup"""
         try:
@@ -329,6 +461,14 @@ class DeviceConfigService:
             
             device_info = backup_data['device_info']
             
+            # One Status 0 round trip up front; parsed through get_device_info so the
+            # cache is refreshed instead of being consulted (it is usually cold here)
+            current = {}
+            if 'device_name' in device_info:
+                status_data = self._fetch_status0(device_ip)
+                if status_data is not None:
+                    current = self.get_device_info(device_ip, status_data=status_data) or {}
+            
             # Restore WiFi settings
             if 'wifi_ssid' in device_info and device_info['wifi_ssid']:
                 # Note: Password won't be in backup for security
@@ -339,8 +479,14 @@ class DeviceConfigService:
             if mqtt_config:
                 result['messages'].append("MQTT configuration restored")
             
-            # Restore device names
+            # Restore device names, skipping the writes when the device already matches
             if 'device_name' in device_info:
+                wanted = (device_info['device_name'], device_info.get('friendly_name'))
+                if (current.get('device_name'), current.get('friendly_name')) == wanted:
+                    result['messages'].append("Device names already match backup")
+                    result['success'] = True
+                    return result
+                
                 name_result = self.configure_device_name(
                     device_ip, 
                     device_info['device_name'],
@@ -359,28 +505,50 @@ class DeviceConfigService:
     def scan_network_for_devices(self, network_range: str = "192.168.1") -> List[Dict[str, Any]]:
         """Scan network for Tasmota devices (similar to Tasmotizer discovery)"""
         try:
-            devices_found = []
-            
-            # This would scan the network range for devices
-            # For now, return mock data
-            mock_devices = [
-                {
-                    'ip': '192.168.1.100',
-                    'hostname': 'tasmota-ABC123',
-                    'device_name': 'Sonoff Basic',
-                    'firmware_version': '13.2.0',
-                    'mac': 'AA:BB:CC:DD:EE:FF',
-                    'online': True,
-                    'discovery_method': 'network_scan'
-                }
-            ]
-            
-            return mock_devices
-            
+            return asyncio.run(self._scan_network_async(network_range))
         except Exception as e:
             logger.error(f"Network scan failed: {e}")
             return []
     
+    async def _scan_network_async(self, network_range: str) -> List[Dict[str, Any]]:
+        """Probe every host of a /24 concurrently, bounded by a semaphore"""
+        sem = asyncio.Semaphore(64)
+        timeout = aiohttp.ClientTimeout(total=1.5)
+        
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            tasks = [self._probe_device(session, sem, f"{network_range}.{i}") for i in range(1, 255)]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        return [r for r in results if isinstance(r, dict)]
+    
+    async def _probe_device(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                            device_ip: str) -> Optional[Dict[str, Any]]:
+        """Query Status 0 on a single host and return a discovery record if it answers"""
+        async with sem:
+            try:
+                async with session.get(f"http://{device_ip}/cm?cmnd=Status%200") as response:
+                    if response.status != 200:
+                        return None
+                    status_data = _loads(await response.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                return None
+        
+        if not isinstance(status_data, dict) or 'Status' not in status_data:
+            return None
+        
+        status = status_data.get('Status', {})
+        firmware = status_data.get('StatusFWR', {})
+        net = status_data.get('StatusNET', {})
+        return {
+            'ip': device_ip,
+            'hostname': net.get('Hostname', ''),
+            'device_name': status.get('DeviceName', 'Unknown'),
+            'firmware_version': firmware.get('Version', ''),
+            'mac': net.get('Mac', ''),
+            'online': True,
+            'discovery_method': 'network_scan'
+        }
+    
     def get_available_templates(self) -> Dict[str, Dict[str, Any]]:
         """Get available device templates"""
         return self.device_templates
@@ -388,24 +556,24 @@ class DeviceConfigService:
     def send_raw_command(self, device_ip: str, command: str) -> Dict[str, Any]:
         """Send raw Tasmota command to device"""
         try:
-            # Validate and sanitize command to prevent injection
-            if not command or len(command) > 100:
-                return {'success': False, 'error': 'Invalid command length', 'command': command}
-            
-            # Basic command validation - only allow alphanumeric and common Tasmota commands
-            import re
-            if not re.match(r'^[a-zA-Z0-9\s_%]+$', command):
+            # Validate and sanitize command to prevent injection - only allow
+            # alphanumeric and common Tasmota commands of bounded length
+            if not command or not _CMD_RE.match(command):
+                if not command or len(command) > 100:
+                    return {'success': False, 'error': 'Invalid command length', 'command': command}
                 return {'success': False, 'error': 'Invalid command characters', 'command': command}
             
+            self._invalidate_device_info(device_ip)
+            
             # URL encode the command to prevent injection
-            encoded_command = urllib.parse.quote(command)
+            encoded_command = _q(command)
             cmd_url = f"http://{device_ip}/cm?cmnd={encoded_command}"
-            response = requests.get(cmd_url, timeout=10)
+            response = self._http.get(cmd_url, timeout=10)
             
             if response.status_code == 200:
                 return {
                     'success': True,
-                    'response': response.json() if response.content else {},
+                    'response': _loads(response.content) if response.content else {},
                     'command': command
                 }
             else:
@@ -1,30 +1,128 @@
-import json
 import logging
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, replace
 from datetime import datetime
 from typing import Dict, Any, Optional, Callable
 import sqlite3
 import os
 
+from utils.json_codec import dumps as _dumps, loads as _loads
+
 logger = logging.getLogger(__name__)
 
+@dataclass(slots=True)
+class DeviceRecord:
+    """Compact in-memory device state; unknown keys are kept in `extra`"""
+    id: str
+    name: str = ''
+    ip: str = ''
+    mac: str = ''
+    firmware_version: str = ''
+    hardware: str = ''
+    template: dict = field(default_factory=dict)
+    config: dict = field(default_factory=dict)
+    last_seen: str = ''
+    status: str = 'unknown'
+    uptime: Any = None
+    free_memory: Any = None
+    wifi_signal: Any = None
+    power_state: Any = None
+    created_at: str = ''
+    updated_at: str = ''
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    def update(self, data: Dict[str, Any]):
+        """Merge a device dict into this record (only before it is published)"""
+        for key, value in data.items():
+            if key in _RECORD_FIELD_SET:
+                setattr(self, key, value)
+            else:
+                self.extra[key] = value
+    
+    def merged(self, data: Dict[str, Any]) -> 'DeviceRecord':
+        """Copy of this record with a device dict merged in; the original is left untouched"""
+        record = replace(self, extra=dict(self.extra))
+        record.update(data)
+        return record
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict view used at the API/callback boundary"""
+        data = {key: getattr(self, key) for key in _RECORD_FIELDS}
+        data.update(self.extra)
+        return data
+
+_RECORD_FIELDS = tuple(f.name for f in fields(DeviceRecord) if f.name != 'extra')
+_RECORD_FIELD_SET = frozenset(_RECORD_FIELDS)
+
 class DeviceManager:
     """Manages Tasmota devices and their state"""
     
     def __init__(self, config_manager):
         self.config_manager = config_manager
-        self.devices = {}
+        # Copy-on-write: published records are never mutated. Writers store a new
+        # record in the existing slot, or swap in a new dict when devices are added
+        # or removed, so readers can use the current reference without locking
+        self.devices: Dict[str, DeviceRecord] = {}
         self.update_callback = None
         self.db_path = '/opt/app/data/devices.db'
         self.lock = threading.Lock()
+        self._tls = threading.local()
+        # Set by close() to stop the background threads
+        self._stop = threading.Event()
+        
+        # Second-resolution wall clock for hot write paths, refreshed by a ticker
+        self._now_iso = datetime.now().isoformat()
+        self.clock_thread = threading.Thread(target=self._clock_loop)
+        self.clock_thread.daemon = True
+        self.clock_thread.start()
         self._init_database()
+        
+        # Telemetry rows are buffered and written in batches by a flush thread
+        self._stats_buf = deque()
+        self._stats_lock = threading.Lock()
+        self._stats_event = threading.Event()
+        self.stats_flush_interval = 1.0
+        self.stats_flush_threshold = 200
+        self.stats_queue_limit = 5000
+        self._stats_exec = ThreadPoolExecutor(max_workers=2, thread_name_prefix='stats')
+        # One slot per submitted-but-unfinished sample; bounds the executor backlog
+        self._stats_slots = threading.BoundedSemaphore(self.stats_queue_limit)
+        self.stats_thread = threading.Thread(target=self._stats_flush_loop)
+        self.stats_thread.daemon = True
+        self.stats_thread.start()
+        
+        # Capped per-device stream of recent samples (newest last) that answers
+        # history queries for windows it fully covers without touching SQLite
+        self.stats_stream_maxlen = 2000
+        self._stats_streams: Dict[str, deque] = {}
+        self._stats_since = time.time()
+    
+    def _clock_loop(self):
+        """Refresh the cached ISO timestamp once per second"""
+        while not self._stop.wait(1):
+            self._now_iso = datetime.now().isoformat()
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's persistent database connection, opening it on first use"""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5,
+                                   cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA mmap_size=134217728')
+            self._tls.conn = conn
+        return conn
     
     def _init_database(self):
         """Initialize SQLite database for device storage"""
         try:
             os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -57,8 +155,12 @@ class DeviceManager:
                 )
             ''')
             
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_stats_dev_ts
+                ON device_stats(device_id, timestamp DESC)
+            ''')
+            
             conn.commit()
-            conn.close()
             logger.info("Database initialized")
         except Exception as e:
             logger.error(f"Database initialization error: {e}")
@@ -67,30 +169,39 @@ class DeviceManager:
         """Set callback function for device updates"""
         self.update_callback = callback
     
+    def _notify_update(self, device_id: str, snapshot: Dict[str, Any]):
+        """Invoke the update callback; must be called without holding self.lock"""
+        if self.update_callback:
+            try:
+                self.update_callback(device_id, snapshot)
+            except Exception as e:
+                logger.error(f"Callback error: {e}")
+    
     def add_device(self, device_data: Dict[str, Any]) -> str:
         """Add or update device"""
         device_id = device_data.get('id') or device_data.get('mac', '').replace(':', '')
         
         with self.lock:
             # Update in-memory storage
-            if device_id in self.devices:
-                self.devices[device_id].update(device_data)
-                self.devices[device_id]['updated_at'] = datetime.now().isoformat()
+            record = self.devices.get(device_id)
+            if record is not None:
+                record = record.merged(device_data)
+                record.updated_at = self._now_iso
+                self.devices[device_id] = record
             else:
                 device_data['id'] = device_id
-                device_data['created_at'] = datetime.now().isoformat()
-                device_data['updated_at'] = datetime.now().isoformat()
-                self.devices[device_id] = device_data
+                record = DeviceRecord(id=device_id)
+                record.update(device_data)
+                record.created_at = self._now_iso
+                record.updated_at = self._now_iso
+                self.devices = {**self.devices, device_id: record}
             
             # Update database
-            self._save_device_to_db(device_id, self.devices[device_id])
-            
-            # Notify callback
-            if self.update_callback:
-                try:
-                    self.update_callback(device_id, self.devices[device_id])
-                except Exception as e:
-                    logger.error(f"Callback error: {e}")
+            snapshot = record.to_dict()
+            self._save_device_to_db(device_id, snapshot)
+        
+        # Notify callback outside the lock so slow subscribers don't block updates
+        self._notify_update(device_id, snapshot)
         
         logger.info(f"Device updated: {device_id}")
         return device_id
@@ -98,57 +209,54 @@ class DeviceManager:
     def _save_device_to_db(self, device_id: str, device_data: Dict[str, Any]):
         """Save device to database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO devices 
-                (id, name, ip, mac, firmware_version, hardware, template, config, 
-                 last_seen, status, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                device_id,
-                device_data.get('name', ''),
-                device_data.get('ip', ''),
-                device_data.get('mac', ''),
-                device_data.get('firmware_version', ''),
-                device_data.get('hardware', ''),
-                json.dumps(device_data.get('template', {})),
-                json.dumps(device_data.get('config', {})),
-                device_data.get('last_seen', datetime.now().isoformat()),
-                device_data.get('status', 'unknown'),
-                datetime.now().isoformat()
-            ))
-            
-            conn.commit()
-            conn.close()
+            conn = self._conn()
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO devices 
+                    (id, name, ip, mac, firmware_version, hardware, template, config, 
+                     last_seen, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    device_id,
+                    device_data.get('name', ''),
+                    device_data.get('ip', ''),
+                    device_data.get('mac', ''),
+                    device_data.get('firmware_version', ''),
+                    device_data.get('hardware', ''),
+                    _dumps(device_data.get('template', {})),
+                    _dumps(device_data.get('config', {})),
+                    device_data.get('last_seen') or self._now_iso,
+                    device_data.get('status', 'unknown'),
+                    self._now_iso
+                ))
         except Exception as e:
             logger.error(f"Database save error: {e}")
     
     def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
         """Get device by ID"""
-        with self.lock:
-            return self.devices.get(device_id)
+        record = self.devices.get(device_id)
+        return record.to_dict() if record is not None else None
     
     def get_all_devices(self) -> Dict[str, Any]:
         """Get all devices"""
-        with self.lock:
-            return self.devices.copy()
+        devices = self.devices
+        return {device_id: record.to_dict() for device_id, record in devices.items()}
     
     def remove_device(self, device_id: str) -> bool:
         """Remove device"""
         with self.lock:
             if device_id in self.devices:
-                del self.devices[device_id]
+                self.devices = {k: v for k, v in self.devices.items() if k != device_id}
                 
                 # Remove from database
                 try:
-                    conn = sqlite3.connect(self.db_path)
-                    cursor = conn.cursor()
-                    cursor.execute('DELETE FROM devices WHERE id = ?', (device_id,))
-                    cursor.execute('DELETE FROM device_stats WHERE device_id = ?', (device_id,))
-                    conn.commit()
-                    conn.close()
+                    self._flush_device_stats()
+                    with self._stats_lock:
+                        self._stats_streams.pop(device_id, None)
+                    conn = self._conn()
+                    with conn:
+                        conn.execute('DELETE FROM devices WHERE id = ?', (device_id,))
+                        conn.execute('DELETE FROM device_stats WHERE device_id = ?', (device_id,))
                 except Exception as e:
                     logger.error(f"Database delete error: {e}")
                 
@@ -160,47 +268,113 @@ class DeviceManager:
         """Update device status"""
         if device_id in self.devices:
             with self.lock:
-                self.devices[device_id]['status'] = status_data.get('status', 'online')
-                self.devices[device_id]['last_seen'] = datetime.now().isoformat()
+                record = self.devices.get(device_id)
+                if record is None:
+                    return
+                changes = {
+                    'status': status_data.get('status', 'online'),
+                    'last_seen': self._now_iso
+                }
                 
                 # Update specific status fields
                 for key in ['uptime', 'free_memory', 'wifi_signal', 'power_state']:
                     if key in status_data:
-                        self.devices[device_id][key] = status_data[key]
+                        changes[key] = status_data[key]
                 
-                # Save stats to database
-                self._save_device_stats(device_id, status_data)
-                
-                # Notify callback
-                if self.update_callback:
-                    try:
-                        self.update_callback(device_id, self.devices[device_id])
-                    except Exception as e:
-                        logger.error(f"Callback error: {e}")
+                # Publish a new record so readers never see a half-applied update
+                record = replace(record, **changes)
+                self.devices[device_id] = record
+                snapshot = record.to_dict()
+            
+            # Encode and queue stats on a worker so the MQTT thread returns immediately
+            if not self._stats_slots.acquire(blocking=False):
+                logger.warning(f"Stats queue full, dropping sample for {device_id}")
+            else:
+                try:
+                    future = self._stats_exec.submit(self._save_device_stats, device_id, dict(status_data))
+                except Exception:
+                    self._stats_slots.release()
+                    raise
+                future.add_done_callback(lambda _: self._stats_slots.release())
+            
+            # Notify callback outside the lock so slow subscribers don't block updates
+            self._notify_update(device_id, snapshot)
     
     def _save_device_stats(self, device_id: str, stats: Dict[str, Any]):
-        """Save device statistics to database"""
+        """Queue device statistics for the next batched database write"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO device_stats 
-                (device_id, uptime, free_memory, wifi_signal, power_state)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
+            now = time.time()
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now))
+            power_state = stats.get('power_state', {})
+            row = (
                 device_id,
+                timestamp,
                 stats.get('uptime'),
                 stats.get('free_memory'),
                 stats.get('wifi_signal'),
-                json.dumps(stats.get('power_state', {}))
-            ))
+                _dumps(power_state)
+            )
+            sample = {
+                'timestamp': timestamp,
+                'uptime': row[2],
+                'free_memory': row[3],
+                'wifi_signal': row[4],
+                'power_state': power_state or {}
+            }
+            with self._stats_lock:
+                self._stats_buf.append(row)
+                pending = len(self._stats_buf)
+                stream = self._stats_streams.get(device_id)
+                if stream is None:
+                    stream = self._stats_streams[device_id] = deque(maxlen=self.stats_stream_maxlen)
+                stream.append((now, sample))
             
-            conn.commit()
-            conn.close()
+            if pending >= self.stats_flush_threshold:
+                self._stats_event.set()
         except Exception as e:
             logger.error(f"Stats save error: {e}")
     
+    def _flush_device_stats(self):
+        """Write all buffered statistics rows in a single transaction"""
+        with self._stats_lock:
+            if not self._stats_buf:
+                return
+            rows = list(self._stats_buf)
+            self._stats_buf.clear()
+        
+        try:
+            conn = self._conn()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO device_stats 
+                    (device_id, timestamp, uptime, free_memory, wifi_signal, power_state)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+        except Exception as e:
+            logger.error(f"Stats flush error ({len(rows)} rows dropped): {e}")
+    
+    def _stats_flush_loop(self):
+        """Flush buffered statistics every interval, or sooner when the buffer fills"""
+        while not self._stop.is_set():
+            self._stats_event.wait(self.stats_flush_interval)
+            self._stats_event.clear()
+            self._flush_device_stats()
+    
+    def close(self):
+        """Stop the background threads and flush any buffered statistics"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._stats_event.set()
+        self._stats_exec.shutdown(wait=True)
+        self.stats_thread.join(timeout=5)
+        self.clock_thread.join(timeout=5)
+        self._flush_device_stats()
+        conn = getattr(self._tls, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._tls.conn = None
+    
     def send_command(self, device_id: str, command: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
         """Send command to device via MQTT"""
         device = self.get_device(device_id)
@@ -218,18 +392,36 @@ class DeviceManager:
             'timestamp': datetime.now().isoformat()
         }
     
+    def _get_streamed_stats(self, device_id: str, hours: int) -> Optional[list]:
+        """Serve a stats window from memory, or None if the stream doesn't cover it"""
+        since = time.time() - int(hours) * 3600
+        if since < self._stats_since:
+            return None
+        
+        with self._stats_lock:
+            stream = self._stats_streams.get(device_id)
+            if stream is None:
+                return []
+            if len(stream) == stream.maxlen and stream[0][0] > since:
+                return None
+            return [sample for ts, sample in reversed(stream) if ts > since]
+    
     def get_device_stats(self, device_id: str, hours: int = 24) -> list:
         """Get device statistics history"""
+        recent = self._get_streamed_stats(device_id, hours)
+        if recent is not None:
+            return recent
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self._flush_device_stats()
+            conn = self._conn()
             
-            cursor.execute('''
+            cursor = conn.execute('''
                 SELECT timestamp, uptime, free_memory, wifi_signal, power_state
                 FROM device_stats
-                WHERE device_id = ? AND timestamp > datetime('now', '-{} hours')
+                WHERE device_id = ? AND timestamp > datetime('now', ?)
                 ORDER BY timestamp DESC
-            '''.format(hours), (device_id,))
+            ''', (device_id, f'-{int(hours)} hours'))
             
             stats = []
             for row in cursor.fetchall():
@@ -238,42 +430,42 @@ class DeviceManager:
                     'uptime': row[1],
                     'free_memory': row[2],
                     'wifi_signal': row[3],
-                    'power_state': json.loads(row[4]) if row[4] else {}
+                    'power_state': _loads(row[4]) if row[4] else {}
                 })
             
-            conn.close()
             return stats
         except Exception as e:
             logger.error(f"Stats retrieval error: {e}")
             return []
     
-    def load_devices_from_db(self):
+    def load_devices_from_db(self) -> int:
         """Load devices from database on startup"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.arraysize = 1000
             
-            cursor.execute('SELECT * FROM devices')
-            rows = cursor.fetchall()
+            rows = cursor.execute('''
+                SELECT id, name, ip, mac, firmware_version, hardware, template, config,
+                       last_seen, status, created_at, updated_at
+                FROM devices
+            ''').fetchall()
             
-            for row in rows:
-                device_data = {
-                    'id': row[0],
-                    'name': row[1],
-                    'ip': row[2],
-                    'mac': row[3],
-                    'firmware_version': row[4],
-                    'hardware': row[5],
-                    'template': json.loads(row[6]) if row[6] else {},
-                    'config': json.loads(row[7]) if row[7] else {},
-                    'last_seen': row[8],
-                    'status': row[9],
-                    'created_at': row[10],
-                    'updated_at': row[11]
-                }
-                self.devices[device_data['id']] = device_data
+            loaded = {
+                row['id']: DeviceRecord(**{
+                    **dict(row),
+                    'template': _loads(row['template']) if row['template'] else {},
+                    'config': _loads(row['config']) if row['config'] else {}
+                })
+                for row in rows
+            }
+            
+            with self.lock:
+                self.devices = {**self.devices, **loaded}
             
-            conn.close()
             logger.info(f"Loaded {len(self.devices)} devices from database")
+            return len(self.devices)
         except Exception as e:
-            logger.error(f"Database load error: {e}")
\ No newline at end of file
+            logger.error(f"Database load error: {e}")
+            return 0
@@ -1,37 +1,218 @@
 import asyncio
+import atexit
+import hashlib
 import json
 import logging
 import sqlite3
+import threading
+import time
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Callable, Dict, List, Optional, Any, Tuple
 from collections import defaultdict, Counter
+from functools import lru_cache
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.cluster import KMeans
+import zlib
+from sklearn.feature_extraction.text import HashingVectorizer
 import joblib
 import os
 
+from utils.json_codec import dumps as _dumps, dumps_sorted as _dumps_sorted, loads as _loads
+
 logger = logging.getLogger(__name__)
 
+# Weights for chip, hardware, feature, historical and community rating scores
+COMPATIBILITY_WEIGHTS = np.array([0.4, 0.25, 0.15, 0.15, 0.05])
+
+INSERT_INSIGHT_SQL = '''
+    INSERT INTO analytics_insights
+    (insight_type, insight_data, confidence, impact_score, actionable, generated_at, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# One statement per usage event: insert, or fold the outcome into the existing
+# pattern with an exponential moving average of the success rate
+UPSERT_USAGE_PATTERN_SQL = '''
+    INSERT INTO device_usage_patterns
+    (device_fingerprint, fingerprint_hash, firmware_id, success_rate, usage_duration,
+     performance_score, stability_score, recommendation_score, last_updated,
+     feature_vector, feature_usage, issues_reported, issue_count)
+    VALUES (?, ?, ?, CAST(? AS REAL), 1, ?, ?, 0.5, ?, ?, ?, ?, COALESCE(?, 0))
+    ON CONFLICT(fingerprint_hash, firmware_id) DO UPDATE SET
+        success_rate = 0.8 * success_rate + 0.2 * excluded.success_rate,
+        usage_duration = usage_duration + 1,
+        performance_score = excluded.performance_score,
+        stability_score = excluded.stability_score,
+        last_updated = excluded.last_updated,
+        feature_vector = excluded.feature_vector,
+        feature_usage = COALESCE(excluded.feature_usage, feature_usage),
+        issues_reported = COALESCE(excluded.issues_reported, issues_reported),
+        issue_count = CASE WHEN excluded.issues_reported IS NULL THEN issue_count
+                           ELSE excluded.issue_count END
+'''
+
+SELECT_RECENT_INSIGHTS_SQL = '''
+    SELECT insight_type, insight_data, confidence, impact_score, generated_at
+    FROM analytics_insights
+    WHERE expires_at > ?
+    ORDER BY generated_at DESC
+    LIMIT 10
+'''
+
+# Dashboard aggregates over the analytics DB, one scan per section
+SELECT_DEVICE_STATS_SQL = '''
+    SELECT COUNT(DISTINCT fingerprint_hash), COUNT(*), AVG(success_rate),
+           AVG(performance_score), AVG(stability_score), COALESCE(SUM(issue_count), 0)
+    FROM device_usage_patterns
+'''
+
+SELECT_COMPATIBILITY_STATS_SQL = '''
+    SELECT COUNT(*), COUNT(DISTINCT firmware_id), COUNT(DISTINCT chip_type),
+           AVG(compatibility_score), COALESCE(SUM(success_count), 0), COALESCE(SUM(failure_count), 0)
+    FROM firmware_compatibility
+'''
+
+SELECT_DAILY_TRENDS_SQL = '''
+    SELECT date(last_updated, 'unixepoch') AS day, COUNT(*), AVG(success_rate),
+           COUNT(DISTINCT firmware_id)
+    FROM device_usage_patterns
+    WHERE last_updated >= ?
+    GROUP BY day
+    ORDER BY day
+'''
+
+_FLASH_RE = re.compile(r'(\d+)')
+
+def _retry_locked(operation: Callable[[], Any], attempts: int = 3) -> Any:
+    """Run a SQLite write, retrying with short backoff while the database is locked/busy"""
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            message = str(e)
+            if attempt == attempts - 1 or ('locked' not in message and 'busy' not in message):
+                raise
+            logger.debug(f"Analytics database busy, retrying: {e}")
+            time.sleep(0.005 * 2 ** attempt)
+
+def _executemany_tx(conn: sqlite3.Connection, sql: str, rows: List[tuple]):
+    """executemany in one write transaction (autocommit connection), rolled back on error"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(sql, rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+@lru_cache(maxsize=4096)
+def _fp_hash(fingerprint_json: str) -> bytes:
+    """16-byte BLAKE2b key for a device fingerprint's JSON text (same devices recur across events)"""
+    return hashlib.blake2b(fingerprint_json.encode(), digest_size=16).digest()
+
+def _canonical_fingerprint(fingerprint_json: str) -> str:
+    """Re-encode stored fingerprint JSON with sorted keys (migration helper)"""
+    try:
+        return _dumps_sorted(json.loads(fingerprint_json))
+    except (ValueError, TypeError):
+        return fingerprint_json
+
+def _quantize_features(vector: np.ndarray) -> bytes:
+    """Pack a [0, 1] feature vector as 10 uint8 bytes for the feature_vector column"""
+    return np.rint(np.clip(vector, 0.0, 1.0) * 255.0).astype(np.uint8).tobytes()
+
+def _cos_scores(matrix: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """Cosine similarity of each row of an L2-normalized (N, 10) float32 matrix to target
+    
+    One BLAS matrix-vector product; numpy releases the GIL for it, so calls from
+    asyncio.to_thread workers run concurrently.
+    """
+    scores = matrix @ target
+    scores /= np.sqrt(np.vdot(target, target)) + 1e-12
+    return scores
+
+@lru_cache(maxsize=4096)
+def _compat_lc(compatibility: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Lowercased hardware compatibility patterns, computed once per distinct list"""
+    return tuple(hw.lower() for hw in compatibility)
+
 class FirmwareAnalyticsEngine:
     """Advanced analytics and AI matching for firmware"""
     
-    def __init__(self, firmware_manager, community_manager):
+    def __init__(self, firmware_manager, community_manager,
+                 db_path: str = '/opt/app/data/firmware_analytics.db',
+                 models_dir: str = '/opt/app/data/models'):
         self.firmware_manager = firmware_manager
         self.community_manager = community_manager
-        self.db_path = '/opt/app/data/firmware_analytics.db'
-        self.models_dir = '/opt/app/data/models'
+        self.db_path = db_path
+        self.models_dir = models_dir
+        
+        # Shared autocommit connections (one per database file). self._lock serializes the
+        # analytics DB and engine caches; the firmware/community DBs have their own locks
+        self._lock = threading.RLock()
+        self._conns: Dict[str, sqlite3.Connection] = {}
+        self._db_locks: Dict[str, threading.Lock] = {}
+        
+        # Similar-device pattern matrix, invalidated by bumping _pattern_version
+        self._pattern_version = 0
+        self._pattern_cache = None
+        self._similar_cache: Dict[tuple, List[Dict[str, Any]]] = {}
+        
+        # Dashboard aggregates, reused for dashboard_ttl seconds or until the next write
+        self.dashboard_ttl = 60
+        self._dashboard_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+        # Bumped on every invalidation so a rebuild racing a write is not cached
+        self._dashboard_version = 0
         
         os.makedirs(self.models_dir, exist_ok=True)
         self._init_analytics_database()
         self._load_or_create_models()
+        atexit.register(self.close)
+    
+    def _get_conn(self, db_path: Optional[str] = None) -> sqlite3.Connection:
+        """Get the shared connection for db_path (analytics DB by default)
+        
+        Callers hold self._lock for the analytics DB, or _db_lock(db_path) for others.
+        """
+        db_path = db_path or self.db_path
+        conn = self._conns.get(db_path)
+        if conn is None:
+            with self._lock:
+                conn = self._conns.get(db_path)
+                if conn is None:
+                    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None,
+                                           cached_statements=256)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute('PRAGMA synchronous=NORMAL')
+                    conn.execute('PRAGMA temp_store=MEMORY')
+                    conn.execute('PRAGMA mmap_size=67108864')
+                    conn.execute('PRAGMA cache_size=-20000')
+                    conn.execute('PRAGMA busy_timeout=2000')
+                    self._conns[db_path] = conn
+        return conn
+    
+    def _db_lock(self, db_path: str) -> threading.Lock:
+        """Lock guarding the shared connection to an external (firmware/community) database"""
+        lock = self._db_locks.get(db_path)
+        if lock is None:
+            with self._lock:
+                lock = self._db_locks.setdefault(db_path, threading.Lock())
+        return lock
+    
+    def close(self):
+        """Close the shared database connections"""
+        with self._lock:
+            for conn in self._conns.values():
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Error closing analytics connection: {e}")
+            self._conns.clear()
     
     def _init_analytics_database(self):
         """Initialize analytics database"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._get_conn()
             cursor = conn.cursor()
             
             # Device usage patterns
@@ -47,10 +228,80 @@ class FirmwareAnalyticsEngine:
                     feature_usage TEXT,
                     issues_reported TEXT,
                     recommendation_score REAL,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    last_updated INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                    feature_vector BLOB,
+                    issue_count INTEGER DEFAULT 0,
+                    fingerprint_hash BLOB
                 )
             ''')
             
+            # Migrate older databases: packed feature vector, issue count and fingerprint hash
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(device_usage_patterns)')}
+            if 'feature_vector' not in columns:
+                cursor.execute('ALTER TABLE device_usage_patterns ADD COLUMN feature_vector BLOB')
+            if 'issue_count' not in columns:
+                cursor.execute('ALTER TABLE device_usage_patterns ADD COLUMN issue_count INTEGER DEFAULT 0')
+                # One-shot backfill from the JSON column using SQLite's JSON1 functions
+                cursor.execute('''
+                    UPDATE device_usage_patterns
+                    SET issue_count = json_array_length(issues_reported)
+                    WHERE json_valid(issues_reported) AND json_type(issues_reported) = 'array'
+                ''')
+            
+            if 'fingerprint_hash' not in columns:
+                cursor.execute('ALTER TABLE device_usage_patterns ADD COLUMN fingerprint_hash BLOB')
+                conn.create_function('fp_hash', 1, _fp_hash, deterministic=True)
+                cursor.execute('''
+                    UPDATE device_usage_patterns
+                    SET fingerprint_hash = fp_hash(device_fingerprint)
+                    WHERE device_fingerprint IS NOT NULL
+                ''')
+            
+            # Schema v1: fingerprints are stored and hashed as sorted-key JSON, so equal
+            # fingerprints with different key order share one row; re-encode older rows
+            # (the unique index is rebuilt, and duplicates merged, by the block below)
+            if cursor.execute('PRAGMA user_version').fetchone()[0] < 1:
+                conn.create_function('fp_hash', 1, _fp_hash, deterministic=True)
+                conn.create_function('fp_canonical', 1, _canonical_fingerprint, deterministic=True)
+                cursor.execute('DROP INDEX IF EXISTS idx_dup_fphash_fw')
+                cursor.execute('''
+                    UPDATE device_usage_patterns
+                    SET device_fingerprint = fp_canonical(device_fingerprint)
+                    WHERE device_fingerprint IS NOT NULL
+                ''')
+                cursor.execute('''
+                    UPDATE device_usage_patterns
+                    SET fingerprint_hash = fp_hash(device_fingerprint)
+                    WHERE device_fingerprint IS NOT NULL
+                ''')
+                cursor.execute('PRAGMA user_version = 1')
+            
+            # last_updated is unix seconds; convert rows written as date text
+            cursor.execute('''
+                UPDATE device_usage_patterns
+                SET last_updated = CAST(strftime('%s', last_updated) AS INTEGER)
+                WHERE typeof(last_updated) = 'text'
+            ''')
+            
+            # One row per (fingerprint, firmware) for the usage-pattern upsert, keyed by the
+            # fingerprint hash; databases created before the constraint keep only the newest
+            # duplicate, and the older full-JSON unique index is dropped
+            if cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_dup_fphash_fw'"
+            ).fetchone() is None:
+                cursor.execute('''
+                    DELETE FROM device_usage_patterns
+                    WHERE id NOT IN (
+                        SELECT MAX(id) FROM device_usage_patterns
+                        GROUP BY fingerprint_hash, firmware_id
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE UNIQUE INDEX idx_dup_fphash_fw
+                    ON device_usage_patterns(fingerprint_hash, firmware_id)
+                ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_dup_fingerprint_fw')
+            
             # Firmware compatibility matrix
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS firmware_compatibility (
@@ -92,39 +343,52 @@ class FirmwareAnalyticsEngine:
                     confidence REAL,
                     impact_score REAL,
                     actionable BOOLEAN,
-                    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP
+                    generated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                    expires_at INTEGER
                 )
             ''')
             
-            conn.commit()
-            conn.close()
+            # Insight timestamps are unix seconds; convert rows written as date text
+            cursor.execute('''
+                UPDATE analytics_insights
+                SET generated_at = CAST(strftime('%s', generated_at) AS INTEGER),
+                    expires_at = CAST(strftime('%s', expires_at) AS INTEGER)
+                WHERE typeof(generated_at) = 'text' OR typeof(expires_at) = 'text'
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_insights_generated ON analytics_insights(generated_at DESC, expires_at)')
+            
+            # Indexes for the similarity, historical success and gap queries
+            # Newest-first walk for the pattern matrix, filtering success_rate from the index
+            # and stopping at the LIMIT (a success_rate-first index needs a temp sort)
+            cursor.execute('DROP INDEX IF EXISTS idx_dup_success_updated')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dup_updated_success ON device_usage_patterns(last_updated DESC, success_rate)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_dup_fw ON device_usage_patterns(firmware_id, success_rate)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fc_fw_chip ON firmware_compatibility(firmware_id, chip_type, hardware_pattern)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fc_hw_chip ON firmware_compatibility(hardware_pattern, chip_type, compatibility_score)')
+            
             logger.info("Analytics database initialized")
         except Exception as e:
             logger.error(f"Analytics database initialization error: {e}")
     
     def _load_or_create_models(self):
         """Load existing ML models or create new ones"""
+        self.device_clusters = None
         try:
-            self.vectorizer_path = os.path.join(self.models_dir, 'device_vectorizer.pkl')
             self.compatibility_model_path = os.path.join(self.models_dir, 'compatibility_model.pkl')
             self.clustering_model_path = os.path.join(self.models_dir, 'device_clusters.pkl')
             
-            # Load or create TF-IDF vectorizer for device descriptions
-            if os.path.exists(self.vectorizer_path):
-                self.device_vectorizer = joblib.load(self.vectorizer_path)
-            else:
-                self.device_vectorizer = TfidfVectorizer(
-                    max_features=1000,
-                    stop_words='english',
-                    ngram_range=(1, 2)
-                )
+            # Hashing vectorizer for device descriptions (stateless, nothing to persist)
+            self.device_vectorizer = HashingVectorizer(
+                n_features=1024,
+                stop_words='english',
+                ngram_range=(1, 2),
+                alternate_sign=False,
+                norm='l2'
+            )
             
-            # Load or create device clustering model
+            # Load a trained device clustering model; without one clustering is skipped
             if os.path.exists(self.clustering_model_path):
                 self.device_clusters = joblib.load(self.clustering_model_path)
-            else:
-                self.device_clusters = KMeans(n_clusters=20, random_state=42)
             
             logger.info("ML models loaded/initialized")
         except Exception as e:
@@ -146,8 +410,8 @@ class FirmwareAnalyticsEngine:
             device_vector = self._create_device_feature_vector(device_info)
             
             # Determine device cluster
-            if hasattr(self.device_clusters, 'predict'):
-                cluster = self.device_clusters.predict([device_vector])[0]
+            if getattr(self.device_clusters, 'cluster_centers_', None) is not None:
+                cluster = (await asyncio.to_thread(self.device_clusters.predict, device_vector[None, :]))[0]
                 analysis['device_cluster'] = int(cluster)
             
             # Find similar devices
@@ -165,20 +429,22 @@ class FirmwareAnalyticsEngine:
             
             all_firmware = firmware_list + community_firmware
             
-            for firmware in all_firmware:
-                compatibility_score = await self._calculate_firmware_compatibility(
-                    device_info, firmware
-                )
-                analysis['compatibility_scores'][firmware['id']] = compatibility_score
+            analysis['compatibility_scores'] = await asyncio.to_thread(
+                self._calculate_compatibility_batch, device_info, all_firmware
+            )
             
-            # Get top recommendations
-            sorted_firmware = sorted(
-                all_firmware,
-                key=lambda f: analysis['compatibility_scores'].get(f['id'], {}).get('total_score', 0),
-                reverse=True
+            # Get top recommendations (top-k partition, then order just those)
+            compatibility_scores = analysis['compatibility_scores']
+            scores = np.fromiter(
+                (compatibility_scores.get(f['id'], {}).get('total_score', 0.0) for f in all_firmware),
+                dtype=np.float64, count=len(all_firmware)
             )
+            top = np.arange(len(scores))
+            if len(scores) > 5:
+                top = np.argpartition(-scores, 5)[:5]
+            top = top[np.argsort(-scores[top], kind='stable')]
             
-            analysis['recommended_firmware'] = sorted_firmware[:5]
+            analysis['recommended_firmware'] = [all_firmware[i] for i in top]
             
             # Risk assessment
             analysis['risk_assessment'] = await self._assess_flashing_risks(
@@ -196,27 +462,26 @@ class FirmwareAnalyticsEngine:
             logger.error(f"Error in device compatibility analysis: {e}")
             return {}
     
-    def _create_device_feature_vector(self, device_info: Dict[str, Any]) -> List[float]:
-        """Create numerical feature vector from device information"""
+    def _create_device_feature_vector(self, device_info: Dict[str, Any]) -> np.ndarray:
+        """Create numerical feature vector (10 float32 values) from device information"""
+        features = np.zeros(10, dtype=np.float32)
         try:
-            features = []
-            
             # Chip type encoding
             chip_encodings = {'ESP32': 1.0, 'ESP8266': 0.5, 'Unknown': 0.0}
-            features.append(chip_encodings.get(device_info.get('chip_type', 'Unknown'), 0.0))
+            features[0] = chip_encodings.get(device_info.get('chip_type', 'Unknown'), 0.0)
             
             # Flash size encoding (normalize to 0-1)
             flash_size = device_info.get('flash_size', 0)
             if isinstance(flash_size, str):
                 # Parse flash size string like "4MB"
-                size_match = re.search(r'(\d+)', flash_size)
+                size_match = _FLASH_RE.search(flash_size)
                 flash_size = int(size_match.group(1)) if size_match else 0
-            features.append(min(flash_size / 16.0, 1.0))  # Normalize with 16MB max
+            features[1] = min(flash_size / 16.0, 1.0)  # Normalize with 16MB max
             
             # Hardware revision hash (simple numeric encoding)
             hardware_rev = device_info.get('hardware', '')
-            hardware_hash = sum(ord(c) for c in hardware_rev) % 100 if hardware_rev else 0
-            features.append(hardware_hash / 100.0)
+            hardware_hash = zlib.crc32(hardware_rev.encode()) % 100 if hardware_rev else 0
+            features[2] = hardware_hash / 100.0
             
             # MAC prefix encoding (manufacturer indicator)
             mac = device_info.get('mac', '')
@@ -224,196 +489,257 @@ class FirmwareAnalyticsEngine:
                 mac_prefix = mac[:8].replace(':', '')
                 try:
                     mac_numeric = int(mac_prefix, 16) % 10000
-                    features.append(mac_numeric / 10000.0)
+                    features[3] = mac_numeric / 10000.0
                 except ValueError:
-                    features.append(0.0)
-            else:
-                features.append(0.0)
+                    pass
             
             # Current firmware version encoding
             current_fw = device_info.get('current_firmware', '')
             if 'tasmota' in current_fw.lower():
-                features.append(1.0)
+                features[4] = 1.0
             elif current_fw:
-                features.append(0.5)
-            else:
-                features.append(0.0)
+                features[4] = 0.5
             
             # GPIO configuration complexity
             gpio_config = device_info.get('gpio_config', {})
             gpio_complexity = len(gpio_config) / 20.0  # Normalize by max expected GPIO count
-            features.append(min(gpio_complexity, 1.0))
+            features[5] = min(gpio_complexity, 1.0)
             
-            # Ensure fixed feature vector size
-            while len(features) < 10:
-                features.append(0.0)
-            
-            return features[:10]  # Fixed size of 10 features
+            # Remaining slots stay zero (fixed size of 10 features)
+            return features
             
         except Exception as e:
             logger.error(f"Error creating device feature vector: {e}")
-            return [0.0] * 10
+            return np.zeros(10, dtype=np.float32)
     
-    async def _find_similar_devices(self, device_info: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
-        """Find devices similar to the given device"""
-        try:
-            target_vector = self._create_device_feature_vector(device_info)
-            similar_devices = []
+    def _get_pattern_matrix(self) -> Tuple[List[tuple], np.ndarray, int]:
+        """Recent successful patterns and their L2-normalized feature matrix
+        
+        Rebuilt only when update_device_usage_pattern has bumped the pattern version.
+        """
+        with self._lock:
+            version = self._pattern_version
+            if self._pattern_cache is not None and self._pattern_cache[2] == version:
+                return self._pattern_cache
             
             # Get device usage patterns from database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            patterns = self._get_conn().execute('''
                 SELECT device_fingerprint, firmware_id, success_rate, 
-                       performance_score, stability_score
+                       performance_score, stability_score, feature_vector
                 FROM device_usage_patterns
                 WHERE success_rate > 0.7
                 ORDER BY last_updated DESC
                 LIMIT 100
-            ''')
+            ''').fetchall()
+        
+        # Stored uint8 vectors are used as-is; older float32 blobs are requantized and
+        # rows written before the column existed need their fingerprint vectorized
+        rows = []
+        blobs = []
+        for pattern in patterns:
+            blob = pattern[5]
+            if blob is not None and len(blob) == 40:
+                blob = _quantize_features(np.frombuffer(blob, dtype=np.float32))
+            elif blob is None or len(blob) != 10:
+                try:
+                    blob = _quantize_features(self._create_device_feature_vector(json.loads(pattern[0])))
+                except (json.JSONDecodeError, ValueError, TypeError):
+                    continue
+            rows.append(pattern)
+            blobs.append(blob)
+        
+        # Cosine similarity is scale-invariant, so the 1/255 dequantization factor
+        # is folded into the row normalization
+        matrix = np.frombuffer(b''.join(blobs), dtype=np.uint8).reshape(-1, 10).astype(np.float32)
+        matrix /= np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None] + 1e-12
+        
+        with self._lock:
+            if self._pattern_version == version:
+                self._pattern_cache = (rows, matrix, version)
+        return rows, matrix, version
+    
+    async def _find_similar_devices(self, device_info: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
+        """Find devices similar to the given device"""
+        return await asyncio.to_thread(self._find_similar_devices_sync, device_info, limit)
+    
+    def _find_similar_devices_sync(self, device_info: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
+        """Blocking body of _find_similar_devices (SQLite + numpy)"""
+        try:
+            target = self._create_device_feature_vector(device_info)
+            rows, matrix, version = self._get_pattern_matrix()
+            
+            if not rows:
+                return []
             
-            patterns = cursor.fetchall()
-            conn.close()
+            # Near-identical targets against the same pattern set share a result
+            memo_key = (version, tuple(np.round(target, 2).tolist()), limit)
+            with self._lock:
+                cached = self._similar_cache.get(memo_key)
+            if cached is not None:
+                return list(cached)
             
-            # Calculate similarity for each device pattern
-            for pattern in patterns:
+            # Cosine similarity for all patterns in a single matrix-vector product
+            sims = _cos_scores(matrix, target)
+            
+            # Threshold for similarity, then top-k without a full sort
+            candidates = np.where(sims > 0.7)[0]
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-sims[candidates], limit)[:limit]]
+            candidates = candidates[np.argsort(-sims[candidates], kind='stable')]
+            
+            similar_devices = []
+            for i in candidates:
+                pattern = rows[i]
                 try:
                     fingerprint_data = json.loads(pattern[0])
-                    pattern_vector = self._create_device_feature_vector(fingerprint_data)
-                    
-                    # Calculate cosine similarity
-                    similarity = cosine_similarity([target_vector], [pattern_vector])[0][0]
-                    
-                    if similarity > 0.7:  # Threshold for similarity
-                        similar_devices.append({
-                            'device_fingerprint': fingerprint_data,
-                            'firmware_id': pattern[1],
-                            'success_rate': pattern[2],
-                            'performance_score': pattern[3],
-                            'stability_score': pattern[4],
-                            'similarity_score': float(similarity)
-                        })
-                
-                except (json.JSONDecodeError, ValueError) as e:
+                except (json.JSONDecodeError, TypeError):
                     continue
+                similar_devices.append({
+                    'device_fingerprint': fingerprint_data,
+                    'firmware_id': pattern[1],
+                    'success_rate': pattern[2],
+                    'performance_score': pattern[3],
+                    'stability_score': pattern[4],
+                    'similarity_score': float(sims[i])
+                })
+            
+            with self._lock:
+                if len(self._similar_cache) >= 512:
+                    self._similar_cache.pop(next(iter(self._similar_cache)))
+                self._similar_cache[memo_key] = similar_devices
             
-            # Sort by similarity and return top results
-            similar_devices.sort(key=lambda x: x['similarity_score'], reverse=True)
-            return similar_devices[:limit]
+            return list(similar_devices)
             
         except Exception as e:
             logger.error(f"Error finding similar devices: {e}")
             return []
     
-    async def _calculate_firmware_compatibility(self, device_info: Dict[str, Any], 
-                                              firmware: Dict[str, Any]) -> Dict[str, Any]:
-        """Calculate detailed compatibility score between device and firmware"""
+    def _calculate_compatibility_batch(self, device_info: Dict[str, Any],
+                                       firmware_list: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Score every firmware against the device in one vectorized pass"""
         try:
-            scores = {
-                'chip_compatibility': 0.0,
-                'hardware_compatibility': 0.0,
-                'feature_compatibility': 0.0,
-                'historical_success': 0.0,
-                'community_rating': 0.0,
-                'total_score': 0.0
-            }
-            
-            # Chip type compatibility (mandatory)
-            device_chip = device_info.get('chip_type', '').upper()
-            firmware_chip = firmware.get('chip_type', '').upper()
-            
-            if device_chip == firmware_chip:
-                scores['chip_compatibility'] = 1.0
-            elif device_chip and firmware_chip:
-                scores['chip_compatibility'] = 0.0  # Incompatible
-            else:
-                scores['chip_compatibility'] = 0.5  # Unknown
-            
-            # Hardware compatibility
-            device_hw = device_info.get('hardware', '').lower()
-            firmware_compat = firmware.get('compatibility', [])
-            
-            if any(hw.lower() in device_hw for hw in firmware_compat):
-                scores['hardware_compatibility'] = 1.0
-            elif firmware_compat:
-                scores['hardware_compatibility'] = 0.3  # Not explicitly compatible
-            else:
-                scores['hardware_compatibility'] = 0.7  # No specific requirements
+            if not firmware_list:
+                return {}
             
-            # Feature compatibility
+            device_chip = (device_info.get('chip_type') or '').upper()
+            device_hw = (device_info.get('hardware') or '').lower()
             device_features = set(device_info.get('required_features', []))
-            firmware_features = set(firmware.get('features', []))
-            
-            if device_features:
-                feature_overlap = len(device_features.intersection(firmware_features))
-                scores['feature_compatibility'] = feature_overlap / len(device_features)
-            else:
-                scores['feature_compatibility'] = 0.8  # No specific requirements
             
-            # Historical success rate
-            historical_score = await self._get_historical_success_rate(
-                device_info, firmware['id']
+            # Chip mismatch is disqualifying: score those without any further work or SQL
+            scores = {}
+            candidates = []
+            for firmware in firmware_list:
+                firmware_chip = (firmware.get('chip_type') or '').upper()
+                if device_chip and firmware_chip and firmware_chip != device_chip:
+                    scores[firmware['id']] = {'chip_compatibility': 0.0, 'total_score': 0.0}
+                else:
+                    candidates.append(firmware)
+            
+            if not candidates:
+                return scores
+            
+            # Per-firmware component scores, columns in COMPATIBILITY_WEIGHTS order
+            components = np.array([
+                self._compatibility_components(device_chip, device_hw, device_features, firmware)
+                for firmware in candidates
+            ], dtype=np.float64)
+            
+            # Historical success rate for the remaining catalog in one query
+            historical = self._get_historical_success_rates_sync(
+                device_info, [firmware['id'] for firmware in candidates]
             )
-            scores['historical_success'] = historical_score
-            
-            # Community rating
-            if 'avg_rating' in firmware and firmware['avg_rating']:
-                scores['community_rating'] = firmware['avg_rating'] / 5.0
-            elif 'rating' in firmware and firmware['rating']:
-                scores['community_rating'] = firmware['rating'] / 5.0
-            else:
-                scores['community_rating'] = 0.5  # Neutral
-            
-            # Calculate weighted total score
-            weights = {
-                'chip_compatibility': 0.4,
-                'hardware_compatibility': 0.25,
-                'feature_compatibility': 0.15,
-                'historical_success': 0.15,
-                'community_rating': 0.05
-            }
-            
-            total_score = sum(scores[key] * weights[key] for key in weights)
-            scores['total_score'] = total_score
-            
+            components[:, 3] = [historical.get(firmware['id'], 0.5) for firmware in candidates]
+            
+            # Calculate weighted total scores
+            totals = components @ COMPATIBILITY_WEIGHTS
+            
+            scores.update({
+                firmware['id']: {
+                    'chip_compatibility': float(row[0]),
+                    'hardware_compatibility': float(row[1]),
+                    'feature_compatibility': float(row[2]),
+                    'historical_success': float(row[3]),
+                    'community_rating': float(row[4]),
+                    'total_score': float(total)
+                }
+                for firmware, row, total in zip(candidates, components, totals)
+            })
             return scores
             
         except Exception as e:
             logger.error(f"Error calculating firmware compatibility: {e}")
-            return {'total_score': 0.0}
+            return {firmware.get('id'): {'total_score': 0.0} for firmware in firmware_list}
     
-    async def _get_historical_success_rate(self, device_info: Dict[str, Any], 
-                                         firmware_id: str) -> float:
-        """Get historical success rate for device type with specific firmware"""
+    @staticmethod
+    def _compatibility_components(device_chip: str, device_hw: str, device_features: set,
+                                  firmware: Dict[str, Any]) -> Tuple[float, float, float, float, float]:
+        """Chip/hardware/feature/rating scores for one firmware (historical filled in later)"""
+        # Chip type compatibility (mandatory)
+        firmware_chip = (firmware.get('chip_type') or '').upper()
+        if device_chip == firmware_chip:
+            chip_score = 1.0
+        elif device_chip and firmware_chip:
+            chip_score = 0.0  # Incompatible
+        else:
+            chip_score = 0.5  # Unknown
+        
+        # Hardware compatibility
+        firmware_compat = firmware.get('compatibility') or ()
+        if any(hw in device_hw for hw in _compat_lc(tuple(firmware_compat))):
+            hw_score = 1.0
+        elif firmware_compat:
+            hw_score = 0.3  # Not explicitly compatible
+        else:
+            hw_score = 0.7  # No specific requirements
+        
+        # Feature compatibility
+        if device_features:
+            feature_overlap = len(device_features.intersection(firmware.get('features', [])))
+            feature_score = feature_overlap / len(device_features)
+        else:
+            feature_score = 0.8  # No specific requirements
+        
+        # Community rating
+        if 'avg_rating' in firmware and firmware['avg_rating']:
+            rating_score = firmware['avg_rating'] / 5.0
+        elif 'rating' in firmware and firmware['rating']:
+            rating_score = firmware['rating'] / 5.0
+        else:
+            rating_score = 0.5  # Neutral
+        
+        return chip_score, hw_score, feature_score, 0.5, rating_score
+    
+    def _get_historical_success_rates_sync(self, device_info: Dict[str, Any],
+                                           firmware_ids: List[str]) -> Dict[str, float]:
+        """Historical success rate per firmware id for this device type, in one grouped query"""
+        rates = {}
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Look for similar device patterns
             device_chip = device_info.get('chip_type', '')
             device_hw = device_info.get('hardware', '')
-            
-            cursor.execute('''
-                SELECT AVG(success_rate), COUNT(*)
-                FROM device_usage_patterns dup
-                JOIN firmware_compatibility fc ON dup.firmware_id = fc.firmware_id
-                WHERE fc.firmware_id = ? 
-                AND fc.chip_type = ?
-                AND (fc.hardware_pattern LIKE ? OR fc.hardware_pattern = '')
-            ''', (firmware_id, device_chip, f'%{device_hw}%'))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result and result[0] is not None and result[1] > 0:
-                return float(result[0])
-            else:
-                return 0.5  # Neutral score when no data available
-                
+            unique_ids = list(dict.fromkeys(firmware_ids))
+            
+            with self._lock:
+                conn = self._get_conn()
+                # Stay well below SQLite's bound-parameter limit
+                for i in range(0, len(unique_ids), 500):
+                    chunk = unique_ids[i:i + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(f'''
+                        SELECT fc.firmware_id, AVG(success_rate), COUNT(*)
+                        FROM device_usage_patterns dup
+                        JOIN firmware_compatibility fc ON dup.firmware_id = fc.firmware_id
+                        WHERE fc.firmware_id IN ({placeholders})
+                        AND fc.chip_type = ?
+                        AND (fc.hardware_pattern LIKE ? OR fc.hardware_pattern = '')
+                        GROUP BY fc.firmware_id
+                    ''', (*chunk, device_chip, f'%{device_hw}%')).fetchall()
+                    
+                    for firmware_id, avg_rate, count in rows:
+                        if avg_rate is not None and count > 0:
+                            rates[firmware_id] = float(avg_rate)
         except Exception as e:
-            logger.error(f"Error getting historical success rate: {e}")
-            return 0.5
+            logger.error(f"Error getting historical success rates: {e}")
+        return rates
     
     async def _assess_flashing_risks(self, device_info: Dict[str, Any], 
                                    recommended_firmware: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -518,18 +844,20 @@ class FirmwareAnalyticsEngine:
             
             # Similarity confidence (based on number and quality of similar devices)
             if similar_devices:
-                avg_similarity = np.mean([d['similarity_score'] for d in similar_devices])
+                similarities = np.fromiter((d['similarity_score'] for d in similar_devices),
+                                           dtype=np.float64, count=len(similar_devices))
+                avg_similarity = float(similarities.mean())
                 device_count_factor = min(len(similar_devices) / 10.0, 1.0)
                 metrics['similarity_confidence'] = avg_similarity * device_count_factor
             
             # Compatibility confidence (based on score distribution)
             if compatibility_scores:
-                scores = [score.get('total_score', 0) for score in compatibility_scores.values()]
-                if scores:
-                    max_score = max(scores)
-                    score_variance = np.var(scores)
-                    # High confidence when there's a clear winner with low variance
-                    metrics['compatibility_confidence'] = max_score * (1 - min(score_variance, 1.0))
+                scores = np.fromiter((score.get('total_score', 0.0) for score in compatibility_scores.values()),
+                                     dtype=np.float64, count=len(compatibility_scores))
+                max_score = float(scores.max())
+                score_variance = float(scores.var())
+                # High confidence when there's a clear winner with low variance
+                metrics['compatibility_confidence'] = max_score * (1 - min(score_variance, 1.0))
             
             # Overall confidence (weighted average)
             weights = {'data_quality': 0.3, 'similarity_confidence': 0.4, 'compatibility_confidence': 0.3}
@@ -569,8 +897,8 @@ class FirmwareAnalyticsEngine:
                 insights.append(community_insight)
             
             # Save insights to database
-            for insight in insights:
-                self._save_insight(insight)
+            if insights:
+                await asyncio.to_thread(self._save_insights, insights)
             
             return insights
             
@@ -580,23 +908,23 @@ class FirmwareAnalyticsEngine:
     
     async def _analyze_firmware_popularity_trends(self) -> Optional[Dict[str, Any]]:
         """Analyze firmware download and usage trends"""
+        return await asyncio.to_thread(self._analyze_firmware_popularity_trends_sync)
+    
+    def _analyze_firmware_popularity_trends_sync(self) -> Optional[Dict[str, Any]]:
+        """Blocking body of _analyze_firmware_popularity_trends"""
         try:
-            conn = sqlite3.connect(self.firmware_manager.db_path)
-            cursor = conn.cursor()
-            
-            # Get download trends over last 30 days
-            cursor.execute('''
-                SELECT f.variant, f.chip_type, COUNT(fd.id) as downloads
-                FROM firmware f
-                LEFT JOIN firmware_downloads fd ON f.id = fd.firmware_id
-                WHERE fd.downloaded_at > datetime('now', '-30 days')
-                GROUP BY f.variant, f.chip_type
-                ORDER BY downloads DESC
-                LIMIT 10
-            ''')
-            
-            trends = cursor.fetchall()
-            conn.close()
+            # Get download trends over last 30 days (bound cutoff keeps downloaded_at index-seekable)
+            cutoff = (datetime.utcnow() - timedelta(days=30)).isoformat(sep=' ', timespec='seconds')
+            with self._db_lock(self.firmware_manager.db_path):
+                trends = self._get_conn(self.firmware_manager.db_path).execute('''
+                    SELECT f.variant, f.chip_type, COUNT(fd.id) as downloads
+                    FROM firmware f
+                    LEFT JOIN firmware_downloads fd ON f.id = fd.firmware_id
+                    WHERE fd.downloaded_at > ?
+                    GROUP BY f.variant, f.chip_type
+                    ORDER BY downloads DESC
+                    LIMIT 10
+                ''', (cutoff,)).fetchall()
             
             if not trends:
                 return None
@@ -612,7 +940,7 @@ class FirmwareAnalyticsEngine:
             
             return {
                 'insight_type': 'firmware_popularity_trends',
-                'insight_data': json.dumps(insight_data),
+                'insight_data': _dumps(insight_data),
                 'confidence': 0.8,
                 'impact_score': 0.7,
                 'actionable': True
@@ -624,23 +952,23 @@ class FirmwareAnalyticsEngine:
     
     async def _analyze_compatibility_gaps(self) -> Optional[Dict[str, Any]]:
         """Identify hardware with poor firmware compatibility"""
+        return await asyncio.to_thread(self._analyze_compatibility_gaps_sync)
+    
+    def _analyze_compatibility_gaps_sync(self) -> Optional[Dict[str, Any]]:
+        """Blocking body of _analyze_compatibility_gaps"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT hardware_pattern, chip_type, 
-                       AVG(compatibility_score) as avg_compatibility,
-                       COUNT(*) as device_count
-                FROM firmware_compatibility
-                GROUP BY hardware_pattern, chip_type
-                HAVING device_count >= 5 AND avg_compatibility < 0.6
-                ORDER BY avg_compatibility ASC
-                LIMIT 10
-            ''')
-            
-            gaps = cursor.fetchall()
-            conn.close()
+            with self._lock:
+                gaps = self._get_conn().execute('''
+                    SELECT hardware_pattern, chip_type, 
+                           AVG(compatibility_score) as avg_compatibility,
+                           COUNT(*) as device_count
+                    FROM firmware_compatibility
+                    WHERE compatibility_score IS NOT NULL
+                    GROUP BY hardware_pattern, chip_type
+                    HAVING device_count >= 5 AND avg_compatibility < 0.6
+                    ORDER BY avg_compatibility ASC
+                    LIMIT 10
+                ''').fetchall()
             
             if not gaps:
                 return None
@@ -664,7 +992,7 @@ class FirmwareAnalyticsEngine:
             
             return {
                 'insight_type': 'compatibility_gaps',
-                'insight_data': json.dumps(insight_data),
+                'insight_data': _dumps(insight_data),
                 'confidence': 0.9,
                 'impact_score': 0.8,
                 'actionable': True
@@ -674,108 +1002,239 @@ class FirmwareAnalyticsEngine:
             logger.error(f"Error analyzing compatibility gaps: {e}")
             return None
     
-    def _save_insight(self, insight: Dict[str, Any]):
-        """Save insight to database"""
+    async def _analyze_success_patterns(self) -> Optional[Dict[str, Any]]:
+        """Find firmware that consistently succeeds or fails across devices"""
+        return await asyncio.to_thread(self._analyze_success_patterns_sync)
+    
+    def _analyze_success_patterns_sync(self) -> Optional[Dict[str, Any]]:
+        """Blocking body of _analyze_success_patterns"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._lock:
+                patterns = self._get_conn().execute('''
+                    SELECT firmware_id, AVG(success_rate) as avg_success,
+                           COUNT(*) as device_count, COALESCE(SUM(issue_count), 0)
+                    FROM device_usage_patterns
+                    GROUP BY firmware_id
+                    HAVING device_count >= 3
+                    ORDER BY avg_success DESC
+                ''').fetchall()
+            
+            reliable = [p for p in patterns if p[1] >= 0.9][:5]
+            problematic = [p for p in reversed(patterns) if p[1] < 0.5][:5]
+            if not reliable and not problematic:
+                return None
             
-            expires_at = datetime.now() + timedelta(days=7)  # Insights expire in 7 days
+            def _entry(pattern):
+                return {
+                    'firmware_id': pattern[0],
+                    'avg_success_rate': pattern[1],
+                    'device_count': pattern[2],
+                    'issue_count': pattern[3]
+                }
             
-            cursor.execute('''
-                INSERT INTO analytics_insights
-                (insight_type, insight_data, confidence, impact_score, actionable, expires_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                insight['insight_type'],
-                insight['insight_data'],
-                insight['confidence'],
-                insight['impact_score'],
-                insight['actionable'],
-                expires_at
-            ))
-            
-            conn.commit()
-            conn.close()
+            insight_data = {
+                'reliable_firmware': [_entry(p) for p in reliable],
+                'problematic_firmware': [_entry(p) for p in problematic]
+            }
+            
+            return {
+                'insight_type': 'success_patterns',
+                'insight_data': _dumps(insight_data),
+                'confidence': 0.85,
+                'impact_score': 0.8 if problematic else 0.6,
+                'actionable': bool(problematic)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error analyzing success patterns: {e}")
+            return None
+    
+    async def _analyze_community_trends(self) -> Optional[Dict[str, Any]]:
+        """Summarize approved community firmware uploaded in the last 30 days"""
+        return await asyncio.to_thread(self._analyze_community_trends_sync)
+    
+    def _analyze_community_trends_sync(self) -> Optional[Dict[str, Any]]:
+        """Blocking body of _analyze_community_trends"""
+        try:
+            # uploaded_at is CURRENT_TIMESTAMP text, so a text cutoff compares in order
+            cutoff = (datetime.utcnow() - timedelta(days=30)).isoformat(sep=' ', timespec='seconds')
+            with self._db_lock(self.community_manager.db_path):
+                trends = self._get_conn(self.community_manager.db_path).execute('''
+                    SELECT id, name, chip_type, download_count, rating
+                    FROM community_firmware
+                    WHERE status = 'approved' AND uploaded_at > ?
+                    ORDER BY download_count DESC, rating DESC
+                    LIMIT 10
+                ''', (cutoff,)).fetchall()
+            
+            if not trends:
+                return None
+            
+            insight_data = {
+                'trending_community_firmware': [
+                    {
+                        'firmware_id': t[0],
+                        'name': t[1],
+                        'chip_type': t[2],
+                        'downloads': t[3],
+                        'rating': t[4]
+                    }
+                    for t in trends
+                ]
+            }
+            
+            return {
+                'insight_type': 'community_trends',
+                'insight_data': _dumps(insight_data),
+                'confidence': 0.7,
+                'impact_score': 0.5,
+                'actionable': False
+            }
+            
+        except Exception as e:
+            logger.error(f"Error analyzing community trends: {e}")
+            return None
+    
+    def _save_insights(self, insights: List[Dict[str, Any]]):
+        """Save insights to database in a single transaction"""
+        try:
+            generated_at = int(time.time())
+            expires_at = generated_at + 7 * 86400  # Insights expire in 7 days
+            rows = [
+                (
+                    insight['insight_type'],
+                    insight['insight_data'],
+                    insight['confidence'],
+                    insight['impact_score'],
+                    insight['actionable'],
+                    generated_at,
+                    expires_at
+                )
+                for insight in insights
+            ]
+            
+            with self._lock:
+                conn = self._get_conn()
+                _retry_locked(lambda: _executemany_tx(conn, INSERT_INSIGHT_SQL, rows))
+                self._invalidate_dashboard()
             
         except Exception as e:
-            logger.error(f"Error saving insight: {e}")
+            logger.error(f"Error saving insights: {e}")
     
     async def update_device_usage_pattern(self, device_fingerprint: Dict[str, Any],
                                         firmware_id: str, success: bool,
                                         performance_data: Dict[str, Any] = None):
         """Update device usage patterns for learning"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            fingerprint_json = json.dumps(device_fingerprint)
+            params = self._usage_pattern_params(device_fingerprint, firmware_id, success, performance_data)
             
-            # Check if pattern exists
-            cursor.execute('''
-                SELECT id, success_rate, usage_duration 
-                FROM device_usage_patterns
-                WHERE device_fingerprint = ? AND firmware_id = ?
-            ''', (fingerprint_json, firmware_id))
-            
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing pattern
-                pattern_id, current_success_rate, usage_duration = existing
-                
-                # Update success rate using exponential moving average
-                new_success_rate = 0.8 * current_success_rate + 0.2 * (1.0 if success else 0.0)
-                
-                cursor.execute('''
-                    UPDATE device_usage_patterns
-                    SET success_rate = ?, usage_duration = ?, 
-                        performance_score = ?, stability_score = ?,
-                        last_updated = ?
-                    WHERE id = ?
-                ''', (
-                    new_success_rate,
-                    usage_duration + 1,
-                    performance_data.get('performance_score', 0.5) if performance_data else 0.5,
-                    performance_data.get('stability_score', 0.5) if performance_data else 0.5,
-                    datetime.now(),
-                    pattern_id
-                ))
-            else:
-                # Create new pattern
-                cursor.execute('''
-                    INSERT INTO device_usage_patterns
-                    (device_fingerprint, firmware_id, success_rate, usage_duration,
-                     performance_score, stability_score, recommendation_score)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    fingerprint_json,
-                    firmware_id,
-                    1.0 if success else 0.0,
-                    1,
-                    performance_data.get('performance_score', 0.5) if performance_data else 0.5,
-                    performance_data.get('stability_score', 0.5) if performance_data else 0.5,
-                    0.5
-                ))
-            
-            conn.commit()
-            conn.close()
+            with self._lock:
+                conn = self._get_conn()
+                _retry_locked(lambda: conn.execute(UPSERT_USAGE_PATTERN_SQL, params))
+                self._patterns_changed()
             
             logger.info(f"Updated device usage pattern: {firmware_id} - {'success' if success else 'failure'}")
             
         except Exception as e:
             logger.error(f"Error updating device usage pattern: {e}")
     
-    def get_analytics_dashboard_data(self) -> Dict[str, Any]:
-        """Get comprehensive analytics data for dashboard"""
+    async def update_device_usage_patterns(self, events: List[Dict[str, Any]]):
+        """Update usage patterns for several events in one transaction
+        
+        Each event has the update_device_usage_pattern arguments as keys.
+        """
         try:
-            dashboard_data = {
-                'firmware_stats': self._get_firmware_statistics(),
-                'device_stats': self._get_device_statistics(),
-                'compatibility_stats': self._get_compatibility_statistics(),
-                'trends': self._get_trend_data(),
-                'insights': self._get_recent_insights()
+            rows = [
+                self._usage_pattern_params(
+                    event['device_fingerprint'], event['firmware_id'],
+                    event['success'], event.get('performance_data')
+                )
+                for event in events
+            ]
+            if not rows:
+                return
+            
+            with self._lock:
+                conn = self._get_conn()
+                _retry_locked(lambda: _executemany_tx(conn, UPSERT_USAGE_PATTERN_SQL, rows))
+                self._patterns_changed()
+            
+            logger.info(f"Updated {len(rows)} device usage patterns")
+            
+        except Exception as e:
+            logger.error(f"Error updating device usage patterns: {e}")
+    
+    def _usage_pattern_params(self, device_fingerprint: Dict[str, Any], firmware_id: str,
+                              success: bool, performance_data: Optional[Dict[str, Any]]) -> tuple:
+        """Bound parameters for UPSERT_USAGE_PATTERN_SQL"""
+        # Sorted keys make the JSON (and so the upsert key) canonical for equal fingerprints
+        fingerprint_json = _dumps_sorted(device_fingerprint)
+        feature_blob = _quantize_features(self._create_device_feature_vector(device_fingerprint))
+        
+        # Scores plus optional feature usage / reported issues (kept as JSON text, queryable
+        # via json_extract), read once; most events carry no performance data at all
+        if performance_data:
+            performance_score = performance_data.get('performance_score', 0.5)
+            stability_score = performance_data.get('stability_score', 0.5)
+            feature_usage = performance_data.get('feature_usage')
+            issues = performance_data.get('issues_reported')
+        else:
+            performance_score = stability_score = 0.5
+            feature_usage = issues = None
+        
+        feature_usage_json = _dumps(feature_usage) if feature_usage is not None else None
+        issues_json = _dumps(issues) if issues is not None else None
+        issue_count = len(issues) if isinstance(issues, list) else None
+        
+        return (
+            fingerprint_json,
+            _fp_hash(fingerprint_json),
+            firmware_id,
+            bool(success),
+            performance_score,
+            stability_score,
+            int(time.time()),
+            feature_blob,
+            feature_usage_json,
+            issues_json,
+            issue_count
+        )
+    
+    def _patterns_changed(self):
+        """Invalidate caches derived from usage patterns; hold self._lock"""
+        self._pattern_version += 1
+        self._similar_cache.clear()
+        self._invalidate_dashboard()
+    
+    def _invalidate_dashboard(self):
+        """Drop cached dashboard data after a write; hold self._lock"""
+        self._dashboard_version += 1
+        self._dashboard_cache = None
+    
+    def get_analytics_dashboard_data(self, refresh: bool = False) -> Dict[str, Any]:
+        """Get comprehensive analytics data for dashboard (cached; refresh=True recomputes)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._dashboard_cache
+            version = self._dashboard_version
+        if not refresh and cached is not None and now < cached[0]:
+            return cached[1]
+        
+        try:
+            # Sections run sequentially: they share one connection per database under its lock
+            sections = {
+                'firmware_stats': self._get_firmware_statistics,
+                'device_stats': self._get_device_statistics,
+                'compatibility_stats': self._get_compatibility_statistics,
+                'trends': self._get_trend_data,
+                'insights': self._get_recent_insights
             }
+            dashboard_data = {key: fn() for key, fn in sections.items()}
+            
+            with self._lock:
+                # Skip caching if a write invalidated the dashboard while it was computed
+                if self._dashboard_version == version:
+                    self._dashboard_cache = (now + self.dashboard_ttl, dashboard_data)
             
             return dashboard_data
             
@@ -788,63 +1247,118 @@ class FirmwareAnalyticsEngine:
         try:
             stats = {}
             
-            # Official firmware stats
-            conn = sqlite3.connect(self.firmware_manager.db_path)
-            cursor = conn.cursor()
+            # Official firmware stats (one scan, conditional aggregates)
+            with self._db_lock(self.firmware_manager.db_path):
+                official_count, development_count = self._get_conn(self.firmware_manager.db_path).execute('''
+                    SELECT COALESCE(SUM(verified = 1), 0),
+                           COALESCE(SUM(channel = 'development'), 0)
+                    FROM firmware
+                ''').fetchone()
             
-            cursor.execute('SELECT COUNT(*) FROM firmware WHERE verified = 1')
-            stats['official_firmware_count'] = cursor.fetchone()[0]
+            # Community firmware stats
+            with self._db_lock(self.community_manager.db_path):
+                community_count, avg_rating = self._get_conn(self.community_manager.db_path).execute('''
+                    SELECT COALESCE(SUM(status = 'approved'), 0),
+                           AVG(CASE WHEN rating > 0 THEN rating END)
+                    FROM community_firmware
+                ''').fetchone()
+            
+            stats['official_firmware_count'] = official_count
+            stats['development_firmware_count'] = development_count
+            stats['community_firmware_count'] = community_count
+            stats['avg_community_rating'] = avg_rating if avg_rating else 0.0
             
-            cursor.execute('SELECT COUNT(*) FROM firmware WHERE channel = "development"')
-            stats['development_firmware_count'] = cursor.fetchone()[0]
+            return stats
             
-            conn.close()
+        except Exception as e:
+            logger.error(f"Error getting firmware statistics: {e}")
+            return {}
+    
+    def _get_device_statistics(self) -> Dict[str, Any]:
+        """Get statistics over recorded device usage patterns"""
+        try:
+            with self._lock:
+                (device_count, pattern_count, avg_success, avg_performance,
+                 avg_stability, issue_count) = self._get_conn().execute(SELECT_DEVICE_STATS_SQL).fetchone()
             
-            # Community firmware stats
-            conn = sqlite3.connect(self.community_manager.db_path)
-            cursor = conn.cursor()
+            return {
+                'tracked_devices': device_count,
+                'usage_patterns': pattern_count,
+                'avg_success_rate': avg_success if avg_success is not None else 0.0,
+                'avg_performance_score': avg_performance if avg_performance is not None else 0.0,
+                'avg_stability_score': avg_stability if avg_stability is not None else 0.0,
+                'issues_reported': issue_count
+            }
             
-            cursor.execute('SELECT COUNT(*) FROM community_firmware WHERE status = "approved"')
-            stats['community_firmware_count'] = cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error getting device statistics: {e}")
+            return {}
+    
+    def _get_compatibility_statistics(self) -> Dict[str, Any]:
+        """Get statistics over the firmware compatibility matrix"""
+        try:
+            with self._lock:
+                (entry_count, firmware_count, chip_count, avg_score,
+                 success_count, failure_count) = self._get_conn().execute(SELECT_COMPATIBILITY_STATS_SQL).fetchone()
             
-            cursor.execute('SELECT AVG(rating) FROM community_firmware WHERE rating > 0')
-            result = cursor.fetchone()
-            stats['avg_community_rating'] = result[0] if result[0] else 0.0
+            attempts = success_count + failure_count
+            return {
+                'compatibility_entries': entry_count,
+                'firmware_covered': firmware_count,
+                'chip_types_covered': chip_count,
+                'avg_compatibility_score': avg_score if avg_score is not None else 0.0,
+                'success_count': success_count,
+                'failure_count': failure_count,
+                'success_ratio': success_count / attempts if attempts else 0.0
+            }
             
-            conn.close()
+        except Exception as e:
+            logger.error(f"Error getting compatibility statistics: {e}")
+            return {}
+    
+    def _get_trend_data(self, days: int = 30) -> Dict[str, Any]:
+        """Get daily usage-pattern activity for the last `days` days"""
+        try:
+            since = int(time.time()) - days * 86400
+            with self._lock:
+                rows = self._get_conn().execute(SELECT_DAILY_TRENDS_SQL, (since,)).fetchall()
             
-            return stats
+            return {
+                'days': days,
+                'daily': [
+                    {
+                        'date': day,
+                        'patterns': count,
+                        'avg_success_rate': avg_success if avg_success is not None else 0.0,
+                        'firmware_count': firmware_count
+                    }
+                    for day, count, avg_success, firmware_count in rows
+                ]
+            }
             
         except Exception as e:
-            logger.error(f"Error getting firmware statistics: {e}")
+            logger.error(f"Error getting trend data: {e}")
             return {}
     
     def _get_recent_insights(self) -> List[Dict[str, Any]]:
         """Get recent analytics insights"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT insight_type, insight_data, confidence, impact_score, generated_at
-                FROM analytics_insights
-                WHERE expires_at > datetime('now')
-                ORDER BY generated_at DESC
-                LIMIT 10
-            ''')
-            
-            insights = []
-            for row in cursor.fetchall():
-                insights.append({
-                    'type': row[0],
-                    'data': json.loads(row[1]),
-                    'confidence': row[2],
-                    'impact_score': row[3],
-                    'generated_at': row[4]
-                })
-            
-            conn.close()
-            return insights
+            with self._lock:
+                cursor = self._get_conn().cursor()
+                cursor.row_factory = sqlite3.Row
+                rows = cursor.execute(SELECT_RECENT_INSIGHTS_SQL, (int(time.time()),)).fetchmany(10)
+            
+            return [
+                {
+                    'type': row['insight_type'],
+                    'data': _loads(row['insight_data']),
+                    'confidence': row['confidence'],
+                    'impact_score': row['impact_score'],
+                    'generated_at': (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(row['generated_at']))
+                                     if row['generated_at'] is not None else None)
+                }
+                for row in rows
+            ]
             
         except Exception as e:
             logger.error(f"Error getting recent insights: {e}")
@@ -1,18 +1,105 @@
 import asyncio
 import aiohttp
+import atexit
+import base64
+import errno
 import hashlib
-import json
+import heapq
 import logging
 import os
 import shutil
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, List, Optional, Any, Tuple
 import tempfile
 from pathlib import Path
 
+import numpy as np
+
+from utils.json_codec import dumps_sorted
+
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_READ_BUFSIZE = 4 * 1024 * 1024
+PROGRESS_INTERVAL = 4 * 1024 * 1024
+# Shared by the resume probe and the download itself (aiohttp's default total)
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=300)
+
+# Hot-path statements, kept as constants so each call hits the connection's statement cache
+SELECT_CACHED_PATH_SQL = '''
+    SELECT local_path FROM firmware_cache 
+    WHERE firmware_id = ? AND verified = 1
+'''
+
+SELECT_CACHED_SIZE_SQL = 'SELECT file_size FROM firmware_cache WHERE firmware_id = ?'
+
+UPSERT_CACHE_ENTRY_SQL = '''
+    INSERT OR REPLACE INTO firmware_cache
+    (firmware_id, local_path, download_url, file_size, 
+     md5_hash, sha256_hash, last_accessed, verified, etag)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 1, ?)
+'''
+
+TOUCH_CACHE_ENTRY_SQL = '''
+    UPDATE firmware_cache 
+    SET last_accessed = CURRENT_TIMESTAMP, download_count = download_count + 1
+    WHERE firmware_id = ?
+'''
+
+DELETE_CACHE_ENTRY_SQL = 'DELETE FROM firmware_cache WHERE firmware_id = ?'
+
+def _hash_file_into(path: str, hasher) -> None:
+    """Feed an existing file into a running hasher"""
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+
+def _file_digest(path: str, algorithm: str) -> str:
+    """Hash a file on disk, streaming through hashlib.file_digest when available"""
+    if hasattr(hashlib, 'file_digest'):
+        with open(path, 'rb') as f:
+            return hashlib.file_digest(f, algorithm).hexdigest()
+    hasher = hashlib.new(algorithm)
+    _hash_file_into(path, hasher)
+    return hasher.hexdigest()
+
+def _fast_move(src: str, dst: str) -> None:
+    """Move a file; across filesystems copy it in-kernel with copy_file_range"""
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    if not hasattr(os, 'copy_file_range'):
+        shutil.move(src, dst)
+        return
+    
+    # Copy next to the destination, then rename so readers never see a partial file
+    tmp_dst = f"{dst}.tmp"
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_dst, 'wb') as fdst:
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                    pass
+            except OSError as e:
+                # Kernels before 5.3 (and some fs pairs) refuse cross-fs copy_file_range
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+    os.remove(src)
+
 class FirmwareCacheManager:
     """Smart caching system for firmware files"""
     
@@ -23,14 +110,44 @@ class FirmwareCacheManager:
         self.max_cache_size = 2 * 1024 * 1024 * 1024  # 2GB
         self.cache_retention_days = 30
         
+        # Single long-lived autocommit connection in WAL mode, serialized by a lock
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Running total of firmware_cache.file_size, loaded lazily from SQLite
+        self._cached_size: Optional[int] = None
+        
+        # In-flight downloads by firmware_id. concurrent.futures.Future so callers on
+        # different event loops (Flask handlers, scheduler) can all await it
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        
+        # Dedicated write/hash lanes so concurrent downloads hash on separate cores
+        self._hash_pool = ThreadPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1), thread_name_prefix='fw-hash'
+        )
+        
         os.makedirs(self.cache_dir, exist_ok=True)
         self._init_cache_database()
+        atexit.register(self.close)
+    
+    def close(self):
+        """Close the cache database connection"""
+        self._hash_pool.shutdown(wait=False)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def _init_cache_database(self):
         """Initialize cache database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                         isolation_level=None, cached_statements=256)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA temp_store=MEMORY')
+            self._conn.execute('PRAGMA cache_size=-64000')
+            cursor = self._conn.cursor()
             
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS firmware_cache (
@@ -47,6 +164,27 @@ class FirmwareCacheManager:
                 )
             ''')
             
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(firmware_cache)')}
+            if 'etag' not in columns:
+                cursor.execute('ALTER TABLE firmware_cache ADD COLUMN etag TEXT')
+            
+            # Interrupted downloads that can be resumed with a Range request
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS partial_downloads (
+                    firmware_id TEXT PRIMARY KEY,
+                    part_path TEXT NOT NULL,
+                    download_url TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # LRU order for cleanup_cache
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_fc_lru
+                ON firmware_cache(last_accessed, download_count)
+            ''')
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS cache_stats (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -59,8 +197,8 @@ class FirmwareCacheManager:
                 )
             ''')
             
-            conn.commit()
-            conn.close()
+            cursor.execute('PRAGMA optimize')
+            
             logger.info("Cache database initialized")
         except Exception as e:
             logger.error(f"Cache database initialization error: {e}")
@@ -68,7 +206,38 @@ class FirmwareCacheManager:
     async def download_and_cache_firmware(self, firmware_id: str, 
                                         download_url: str, 
                                         progress_callback=None) -> Optional[str]:
+        """Download and cache firmware file, sharing one transfer between concurrent callers"""
+        with self._inflight_lock:
+            inflight = self._inflight.get(firmware_id)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[firmware_id] = Future()
+        
+        if not owner:
+            # Another caller is already fetching this firmware; wait for its result
+            logger.debug(f"Joining in-flight download of {firmware_id}")
+            return await asyncio.shield(asyncio.wrap_future(inflight))
+        
+        result = None
+        try:
+            result = await self._download_and_cache_firmware(
+                firmware_id, download_url, progress_callback
+            )
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[firmware_id]
+            inflight.set_result(result)
+    
+    async def _download_and_cache_firmware(self, firmware_id: str, 
+                                         download_url: str, 
+                                         progress_callback=None) -> Optional[str]:
         """Download and cache firmware file"""
+        temp_path = None
+        tmp_fd = None
+        etag = None
+        # ETag of a range-capable response, filled in by _download_file as soon as headers arrive
+        download_meta: Dict[str, Optional[str]] = {}
         try:
             # Check if already cached
             cached_path = self.get_cached_firmware_path(firmware_id)
@@ -76,28 +245,59 @@ class FirmwareCacheManager:
                 self._update_access_time(firmware_id)
                 return cached_path
             
-            # Create temp file for download
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.bin')
-            temp_path = temp_file.name
-            temp_file.close()
+            cache_filename = f"{firmware_id}.bin"
+            cache_path = os.path.join(self.cache_dir, cache_filename)
+            part_path = f"{cache_path}.part"
+            
+            # Resume an interrupted transfer when the server still serves the same ETag
+            resume_from, etag = await self._resume_point(firmware_id, download_url)
+            download_meta['etag'] = etag
+            
+            if resume_from:
+                temp_path = part_path
+            else:
+                # Download into an unnamed file inside the cache dir when the kernel
+                # supports it, so publishing it is a link rather than a copy
+                tmp_fd = self._open_anonymous_cache_file()
+                if tmp_fd is not None:
+                    temp_path = f"/proc/self/fd/{tmp_fd}"
+                else:
+                    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.bin')
+                    temp_path = temp_file.name
+                    temp_file.close()
             
             # Download firmware
-            logger.info(f"Downloading firmware: {download_url}")
+            logger.info(f"Downloading firmware: {download_url}"
+                        + (f" (resuming at {resume_from} bytes)" if resume_from else ""))
             file_size, md5_hash, sha256_hash = await self._download_file(
-                download_url, temp_path, progress_callback
+                download_url, temp_path, progress_callback, resume_from, etag, download_meta
             )
-            
-            # Move to cache directory
-            cache_filename = f"{firmware_id}.bin"
-            cache_path = os.path.join(self.cache_dir, cache_filename)
-            shutil.move(temp_path, cache_path)
+            etag = download_meta['etag']
             
             # Verify file integrity
-            if await self._verify_firmware_file(cache_path):
+            if resume_from:
+                valid = await self._verify_firmware_file(part_path)
+                if valid:
+                    os.replace(part_path, cache_path)
+                self._discard_partial(firmware_id, part_path)
+                temp_path = None
+            elif tmp_fd is not None:
+                valid = await self._verify_firmware_file(temp_path)
+                if valid:
+                    self._link_anonymous_file(tmp_fd, cache_path)
+            else:
+                # Move to cache directory
+                _fast_move(temp_path, cache_path)
+                temp_path = None
+                valid = await self._verify_firmware_file(cache_path)
+                if not valid:
+                    os.remove(cache_path)
+            
+            if valid:
                 # Add to cache database
                 self._add_to_cache_db(
                     firmware_id, cache_path, download_url, 
-                    file_size, md5_hash, sha256_hash
+                    file_size, md5_hash, sha256_hash, etag
                 )
                 
                 # Update firmware manager with local path
@@ -107,46 +307,208 @@ class FirmwareCacheManager:
                 return cache_path
             else:
                 logger.error(f"Firmware verification failed: {cache_filename}")
-                os.remove(cache_path)
                 return None
                 
         except Exception as e:
             logger.error(f"Error downloading/caching firmware: {e}")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            etag = download_meta.get('etag', etag)
+            if temp_path and not self._keep_partial(firmware_id, download_url, etag, temp_path, tmp_fd):
+                if tmp_fd is None and os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return None
+        finally:
+            # Closing an unlinked O_TMPFILE descriptor discards the data
+            if tmp_fd is not None:
+                os.close(tmp_fd)
+    
+    async def _probe_download(self, url: str) -> Tuple[int, Optional[str]]:
+        """HEAD the download URL for its length and ETag (None unless ranges are supported)"""
+        try:
+            async with aiohttp.ClientSession(timeout=DOWNLOAD_TIMEOUT) as session:
+                async with session.head(url, allow_redirects=True) as response:
+                    if response.status != 200:
+                        return 0, None
+                    content_length = int(response.headers.get('content-length', 0))
+                    if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+                        return content_length, None
+                    return content_length, response.headers.get('ETag')
+        except Exception as e:
+            logger.debug(f"Download probe failed for {url}: {e}")
+            return 0, None
+    
+    async def _resume_point(self, firmware_id: str,
+                            download_url: str) -> Tuple[int, Optional[str]]:
+        """Offset and ETag to resume a recorded .part file at, or (0, None) (discarding stale parts)
+        
+        The server is only probed when a partial download is on record.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT part_path, download_url, etag FROM partial_downloads WHERE firmware_id = ?',
+                (firmware_id,)
+            ).fetchone()
+        if not row:
+            return 0, None
+        
+        part_path, part_url, part_etag = row
+        part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if part_size and part_url == download_url:
+            content_length, etag = await self._probe_download(download_url)
+            if etag and part_etag == etag and part_size < content_length:
+                return part_size, etag
+        
+        self._discard_partial(firmware_id, part_path)
+        return 0, None
+    
+    def _keep_partial(self, firmware_id: str, download_url: str, etag: Optional[str],
+                      temp_path: str, tmp_fd: Optional[int]) -> bool:
+        """Preserve an interrupted download as <id>.bin.part for a later Range resume"""
+        if not etag:
+            return False
+        try:
+            if os.path.getsize(temp_path) == 0:
+                return False
+            
+            part_path = os.path.join(self.cache_dir, f"{firmware_id}.bin.part")
+            if tmp_fd is not None:
+                self._link_anonymous_file(tmp_fd, part_path)
+            elif temp_path != part_path:
+                _fast_move(temp_path, part_path)
+            
+            with self._lock:
+                self._conn.execute('''
+                    INSERT OR REPLACE INTO partial_downloads
+                    (firmware_id, part_path, download_url, etag)
+                    VALUES (?, ?, ?, ?)
+                ''', (firmware_id, part_path, download_url, etag))
+            return True
+        except Exception as e:
+            logger.error(f"Error keeping partial download for {firmware_id}: {e}")
+            return False
+    
+    def _discard_partial(self, firmware_id: str, part_path: str):
+        """Forget a partial download and remove its file"""
+        try:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            with self._lock:
+                self._conn.execute('DELETE FROM partial_downloads WHERE firmware_id = ?', (firmware_id,))
+        except Exception as e:
+            logger.error(f"Error discarding partial download for {firmware_id}: {e}")
+    
+    def _open_anonymous_cache_file(self) -> Optional[int]:
+        """Open an unnamed O_TMPFILE in the cache dir, or None when unsupported"""
+        if not hasattr(os, 'O_TMPFILE'):
+            return None
+        try:
+            fd = os.open(self.cache_dir, os.O_TMPFILE | os.O_RDWR, 0o644)
+        except OSError:
             return None
+        if not os.path.exists(f"/proc/self/fd/{fd}"):
+            os.close(fd)
+            return None
+        return fd
+    
+    def _link_anonymous_file(self, fd: int, cache_path: str):
+        """Give an O_TMPFILE a name in the cache dir"""
+        # Passing src_dir_fd makes os.link use linkat(..., AT_SYMLINK_FOLLOW),
+        # which resolves the /proc magic link to the unnamed inode
+        proc_fd = os.open('/proc/self/fd', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            try:
+                os.link(str(fd), cache_path, src_dir_fd=proc_fd, follow_symlinks=True)
+            except FileExistsError:
+                os.remove(cache_path)
+                os.link(str(fd), cache_path, src_dir_fd=proc_fd, follow_symlinks=True)
+        finally:
+            os.close(proc_fd)
     
     async def _download_file(self, url: str, local_path: str, 
-                           progress_callback=None) -> Tuple[int, str, str]:
-        """Download file with progress tracking"""
+                           progress_callback=None, resume_from: int = 0,
+                           etag: Optional[str] = None,
+                           download_meta: Optional[Dict[str, Optional[str]]] = None
+                           ) -> Tuple[int, str, str]:
+        """Download file with progress tracking, optionally resuming at resume_from
+        
+        A fresh (200) response's ETag is stored in download_meta['etag'] when the server
+        accepts ranges, so an interrupted transfer can be resumed later.
+        """
         file_size = 0
-        md5_hasher = hashlib.md5()
+        md5_hash = ""
         sha256_hasher = hashlib.sha256()
         
+        headers = {}
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            if etag:
+                headers['If-Range'] = etag
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
+            async with aiohttp.ClientSession(read_bufsize=DOWNLOAD_READ_BUFSIZE,
+                                             timeout=DOWNLOAD_TIMEOUT) as session:
+                async with session.get(url, headers=headers) as response:
                     response.raise_for_status()
                     
+                    if download_meta is not None and response.status == 200:
+                        accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                        download_meta['etag'] = response.headers.get('ETag') if accepts_ranges else None
+                    
+                    # 206 continues the existing part; a 200 means the server restarted the body
+                    offset = resume_from if resume_from and response.status == 206 else 0
+                    if offset:
+                        await asyncio.get_running_loop().run_in_executor(
+                            self._hash_pool, _hash_file_into, local_path, sha256_hasher
+                        )
+                    
                     total_size = int(response.headers.get('content-length', 0))
-                    downloaded = 0
+                    if total_size:
+                        total_size += offset
+                    downloaded = offset
+                    file_size = offset
+                    last_reported = offset
+                    
+                    def write_and_hash(chunk: bytes):
+                        f.write(chunk)
+                        sha256_hasher.update(chunk)
                     
-                    with open(local_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            file_size += len(chunk)
-                            
-                            # Update hashes
-                            md5_hasher.update(chunk)
-                            sha256_hasher.update(chunk)
-                            
-                            # Report progress
-                            if progress_callback and total_size > 0:
-                                progress = (downloaded / total_size) * 100
-                                await progress_callback(progress, downloaded, total_size)
-            
-            return file_size, md5_hasher.hexdigest(), sha256_hasher.hexdigest()
+                    with open(local_path, 'ab' if offset else 'wb') as f:
+                        # Write/hash chunk N in a worker thread while chunk N+1 is received
+                        loop = asyncio.get_running_loop()
+                        pending = None
+                        try:
+                            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                if pending is not None:
+                                    await pending
+                                pending = loop.run_in_executor(self._hash_pool, write_and_hash, chunk)
+                                downloaded += len(chunk)
+                                file_size += len(chunk)
+                                
+                                # Report progress every PROGRESS_INTERVAL bytes and on completion
+                                if (progress_callback and total_size > 0 and
+                                        (downloaded - last_reported >= PROGRESS_INTERVAL or
+                                         downloaded >= total_size)):
+                                    last_reported = downloaded
+                                    progress = (downloaded / total_size) * 100
+                                    await progress_callback(progress, downloaded, total_size)
+                        finally:
+                            # Never close the file while a worker is still writing to it
+                            if pending is not None:
+                                await pending
+                    
+                    # Check the body against a published Content-MD5 (base64 of the raw digest);
+                    # on a 206 the header only covers the tail, so resumed transfers skip it
+                    content_md5 = response.headers.get('Content-MD5')
+                    if content_md5 and not offset:
+                        md5_hash = await loop.run_in_executor(
+                            self._hash_pool, _file_digest, local_path, 'md5'
+                        )
+                        if base64.b64encode(bytes.fromhex(md5_hash)).decode() != content_md5.strip():
+                            # A corrupt body must not be kept as a resumable part
+                            if download_meta is not None:
+                                download_meta['etag'] = None
+                            raise ValueError(f"Content-MD5 mismatch for {url}")
+            
+            return file_size, md5_hash, sha256_hasher.hexdigest()
             
         except Exception as e:
             logger.error(f"Download failed: {e}")
@@ -155,29 +517,33 @@ class FirmwareCacheManager:
     async def _verify_firmware_file(self, file_path: str) -> bool:
         """Verify firmware file integrity"""
         try:
-            # Basic file checks
-            if not os.path.exists(file_path):
+            # Basic file checks: one open, fstat and pread instead of exists/getsize/open/read
+            try:
+                fd = os.open(file_path, os.O_RDONLY)
+            except FileNotFoundError:
                 return False
             
-            file_size = os.path.getsize(file_path)
-            if file_size < 100000:  # Less than 100KB is suspicious
-                logger.warning(f"Firmware file too small: {file_size} bytes")
-                return False
+            try:
+                file_size = os.fstat(fd).st_size
+                if file_size < 100000:  # Less than 100KB is suspicious
+                    logger.warning(f"Firmware file too small: {file_size} bytes")
+                    return False
+                
+                header = os.pread(fd, 16, 0)
+            finally:
+                os.close(fd)
             
             # Check for valid firmware header (basic check)
-            with open(file_path, 'rb') as f:
-                header = f.read(16)
-                
-                # ESP32 firmware magic
-                if header[:4] == b'\xE9\x00\x00\x00':
-                    return True
-                
-                # ESP8266 firmware magic  
-                if header[0] == 0xE9:
-                    return True
-                
-                logger.warning("No valid firmware magic found")
-                return False
+            # ESP32 firmware magic
+            if header[:4] == b'\xE9\x00\x00\x00':
+                return True
+            
+            # ESP8266 firmware magic  
+            if header[0] == 0xE9:
+                return True
+            
+            logger.warning("No valid firmware magic found")
+            return False
                 
         except Exception as e:
             logger.error(f"Firmware verification error: {e}")
@@ -185,40 +551,25 @@ class FirmwareCacheManager:
     
     def _add_to_cache_db(self, firmware_id: str, local_path: str, 
                         download_url: str, file_size: int, 
-                        md5_hash: str, sha256_hash: str):
+                        md5_hash: str, sha256_hash: str, etag: Optional[str] = None):
         """Add firmware to cache database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO firmware_cache
-                (firmware_id, local_path, download_url, file_size, 
-                 md5_hash, sha256_hash, last_accessed, verified)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                firmware_id, local_path, download_url, file_size,
-                md5_hash, sha256_hash, datetime.now(), True
-            ))
-            
-            conn.commit()
-            conn.close()
+            with self._lock:
+                previous = self._conn.execute(SELECT_CACHED_SIZE_SQL, (firmware_id,)).fetchone()
+                self._conn.execute(UPSERT_CACHE_ENTRY_SQL, (
+                    firmware_id, local_path, download_url, file_size,
+                    md5_hash, sha256_hash, etag
+                ))
+                if self._cached_size is not None:
+                    self._cached_size += (file_size or 0) - ((previous[0] or 0) if previous else 0)
         except Exception as e:
             logger.error(f"Error adding to cache database: {e}")
     
     def get_cached_firmware_path(self, firmware_id: str) -> Optional[str]:
         """Get cached firmware path if available"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT local_path FROM firmware_cache 
-                WHERE firmware_id = ? AND verified = 1
-            ''', (firmware_id,))
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self._lock:
+                result = self._conn.execute(SELECT_CACHED_PATH_SQL, (firmware_id,)).fetchone()
             
             if result and os.path.exists(result[0]):
                 return result[0]
@@ -235,17 +586,8 @@ class FirmwareCacheManager:
     def _update_access_time(self, firmware_id: str):
         """Update last accessed time for cache entry"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE firmware_cache 
-                SET last_accessed = ?, download_count = download_count + 1
-                WHERE firmware_id = ?
-            ''', (datetime.now(), firmware_id))
-            
-            conn.commit()
-            conn.close()
+            with self._lock:
+                self._conn.execute(TOUCH_CACHE_ENTRY_SQL, (firmware_id,))
         except Exception as e:
             logger.error(f"Error updating access time: {e}")
     
@@ -256,9 +598,9 @@ class FirmwareCacheManager:
             cursor = conn.cursor()
             
             cursor.execute('''
-                UPDATE firmware SET local_path = ?, updated_at = ?
+                UPDATE firmware SET local_path = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
-            ''', (local_path, datetime.now(), firmware_id))
+            ''', (local_path, firmware_id))
             
             conn.commit()
             conn.close()
@@ -277,24 +619,28 @@ class FirmwareCacheManager:
             
             logger.info("Starting cache cleanup...")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Get files to remove (oldest first, least accessed)
-            cutoff_date = datetime.now() - timedelta(days=self.cache_retention_days)
+            # Get files to remove (oldest first, least accessed); the cutoff is
+            # computed in SQLite so it matches CURRENT_TIMESTAMP (UTC) access times
+            cutoff_modifier = f'-{self.cache_retention_days} days'
+            
+            with self._lock:
+                # UNION rather than OR so the stale branch can range-scan idx_fc_lru
+                candidates = self._conn.execute('''
+                    SELECT firmware_id, local_path, file_size, last_accessed, download_count
+                    FROM firmware_cache
+                    WHERE last_accessed < datetime('now', ?)
+                    UNION
+                    SELECT firmware_id, local_path, file_size, last_accessed, download_count
+                    FROM firmware_cache
+                    WHERE download_count = 0
+                    ORDER BY last_accessed ASC, download_count ASC
+                ''', (cutoff_modifier,)).fetchall()
             
-            cursor.execute('''
-                SELECT firmware_id, local_path, file_size 
-                FROM firmware_cache
-                WHERE last_accessed < ? OR download_count = 0
-                ORDER BY last_accessed ASC, download_count ASC
-            ''', (cutoff_date,))
-            
-            candidates = cursor.fetchall()
             removed_size = 0
             removed_count = 0
+            removed_ids = []
             
-            for firmware_id, local_path, file_size in candidates:
+            for firmware_id, local_path, file_size, _, _ in candidates:
                 if current_size - removed_size < self.max_cache_size * 0.7:
                     break
                 
@@ -302,7 +648,7 @@ class FirmwareCacheManager:
                     if os.path.exists(local_path):
                         os.remove(local_path)
                     
-                    self._remove_from_cache_db(firmware_id)
+                    removed_ids.append(firmware_id)
                     removed_size += file_size or 0
                     removed_count += 1
                     
@@ -311,7 +657,21 @@ class FirmwareCacheManager:
                 except Exception as e:
                     logger.error(f"Error removing cached file {local_path}: {e}")
             
-            conn.close()
+            # Drop all removed rows in one transaction; unlinks stay outside it
+            if removed_ids:
+                with self._lock:
+                    self._conn.execute('BEGIN')
+                    try:
+                        self._conn.executemany(
+                            DELETE_CACHE_ENTRY_SQL,
+                            [(firmware_id,) for firmware_id in removed_ids]
+                        )
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                    if self._cached_size is not None:
+                        self._cached_size -= removed_size
             
             logger.info(f"Cache cleanup completed: removed {removed_count} files, "
                        f"freed {removed_size / 1024 / 1024:.1f} MB")
@@ -324,46 +684,42 @@ class FirmwareCacheManager:
     
     def _get_cache_size(self) -> int:
         """Get total cache size in bytes"""
-        total_size = 0
         try:
-            for root, dirs, files in os.walk(self.cache_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    total_size += os.path.getsize(file_path)
+            with self._lock:
+                if self._cached_size is None:
+                    row = self._conn.execute(
+                        'SELECT COALESCE(SUM(file_size), 0) FROM firmware_cache'
+                    ).fetchone()
+                    self._cached_size = row[0]
+                return self._cached_size
         except Exception as e:
             logger.error(f"Error calculating cache size: {e}")
-        
-        return total_size
+            return 0
     
     def _remove_from_cache_db(self, firmware_id: str):
         """Remove firmware from cache database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM firmware_cache WHERE firmware_id = ?', (firmware_id,))
-            conn.commit()
-            conn.close()
+            with self._lock:
+                row = self._conn.execute(SELECT_CACHED_SIZE_SQL, (firmware_id,)).fetchone()
+                self._conn.execute(DELETE_CACHE_ENTRY_SQL, (firmware_id,))
+                if row and self._cached_size is not None:
+                    self._cached_size -= row[0] or 0
         except Exception as e:
             logger.error(f"Error removing from cache database: {e}")
     
     def _record_cleanup_stats(self, removed_count: int, removed_size: int):
         """Record cleanup statistics"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Get current stats
             total_size = self._get_cache_size()
-            file_count = len([f for f in os.listdir(self.cache_dir) if f.endswith('.bin')])
             
-            cursor.execute('''
-                INSERT INTO cache_stats 
-                (total_size, file_count, last_cleanup)
-                VALUES (?, ?, ?)
-            ''', (total_size, file_count, datetime.now()))
-            
-            conn.commit()
-            conn.close()
+            with self._lock:
+                file_count = self._conn.execute('SELECT COUNT(*) FROM firmware_cache').fetchone()[0]
+                self._conn.execute('''
+                    INSERT INTO cache_stats 
+                    (total_size, file_count, last_cleanup)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (total_size, file_count))
         except Exception as e:
             logger.error(f"Error recording cleanup stats: {e}")
     
@@ -378,24 +734,20 @@ class FirmwareCacheManager:
                 'last_cleanup': None
             }
             
-            # Count files
-            stats['file_count'] = len([f for f in os.listdir(self.cache_dir) 
-                                     if f.endswith('.bin')])
-            
             # Get database stats
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT SUM(download_count) FROM firmware_cache')
-            result = cursor.fetchone()
-            stats['total_downloads'] = result[0] or 0
-            
-            cursor.execute('SELECT last_cleanup FROM cache_stats ORDER BY id DESC LIMIT 1')
-            result = cursor.fetchone()
-            if result:
-                stats['last_cleanup'] = result[0]
+            with self._lock:
+                result = self._conn.execute(
+                    'SELECT COUNT(*), SUM(download_count) FROM firmware_cache'
+                ).fetchone()
+                stats['file_count'] = result[0]
+                stats['total_downloads'] = result[1] or 0
+                
+                result = self._conn.execute(
+                    'SELECT last_cleanup FROM cache_stats ORDER BY id DESC LIMIT 1'
+                ).fetchone()
+                if result:
+                    stats['last_cleanup'] = result[0]
             
-            conn.close()
             return stats
             
         except Exception as e:
@@ -458,31 +810,33 @@ class FirmwareRecommendationEngine:
             # Get device fingerprint
             fingerprint = self._create_device_fingerprint(device_info)
             
+            # Verified firmware for this chip, shared by the rule-based and popular passes
+            chip_firmware = self.firmware_manager.get_firmware_list(
+                chip_type=fingerprint['chip_type'],
+                verified_only=True
+            )
+            
             # Rule-based recommendations
-            rule_based = self._get_rule_based_recommendations(fingerprint, limit)
+            rule_based = self._get_rule_based_recommendations(fingerprint, limit, chip_firmware)
             recommendations.extend(rule_based)
             
-            # Collaborative filtering
+            # Collaborative filtering (builds the firmware index only if it finds candidates)
             collaborative = self._get_collaborative_recommendations(fingerprint, limit)
             recommendations.extend(collaborative)
             
             # Popular firmware for chip type
-            popular = self._get_popular_recommendations(fingerprint, limit)
+            popular = self._get_popular_recommendations(fingerprint, limit, chip_firmware)
             recommendations.extend(popular)
             
-            # Remove duplicates and sort by confidence
-            seen = set()
-            unique_recommendations = []
-            
+            # Remove duplicates, keeping the strongest recommendation per firmware
+            best = {}
             for rec in recommendations:
-                if rec['firmware_id'] not in seen:
-                    seen.add(rec['firmware_id'])
-                    unique_recommendations.append(rec)
-            
-            # Sort by confidence score
-            unique_recommendations.sort(key=lambda x: x['confidence'], reverse=True)
+                current = best.get(rec['firmware_id'])
+                if current is None or rec['confidence'] > current['confidence']:
+                    best[rec['firmware_id']] = rec
             
-            return unique_recommendations[:limit]
+            # Top `limit` by confidence score
+            return heapq.nlargest(limit, best.values(), key=lambda x: x['confidence'])
             
         except Exception as e:
             logger.error(f"Error getting firmware recommendations: {e}")
@@ -496,19 +850,22 @@ class FirmwareRecommendationEngine:
             'hardware_revision': device_info.get('hardware', ''),
             'mac_prefix': device_info.get('mac', '')[:8] if device_info.get('mac') else '',
             'current_firmware': device_info.get('current_firmware', ''),
-            'gpio_config': json.dumps(device_info.get('gpio_config', {}))
+            'gpio_config': dumps_sorted(device_info.get('gpio_config', {}))
         }
     
     def _get_rule_based_recommendations(self, fingerprint: Dict[str, Any], 
-                                      limit: int) -> List[Dict[str, Any]]:
+                                      limit: int,
+                                      firmware_list: Optional[List[Dict[str, Any]]] = None
+                                      ) -> List[Dict[str, Any]]:
         """Get rule-based firmware recommendations"""
         recommendations = []
         
         # Get available firmware for chip type
-        firmware_list = self.firmware_manager.get_firmware_list(
-            chip_type=fingerprint['chip_type'],
-            verified_only=True
-        )
+        if firmware_list is None:
+            firmware_list = self.firmware_manager.get_firmware_list(
+                chip_type=fingerprint['chip_type'],
+                verified_only=True
+            )
         
         for firmware in firmware_list[:limit]:
             confidence = 0.5  # Base confidence
@@ -545,7 +902,9 @@ class FirmwareRecommendationEngine:
         return recommendations
     
     def _get_collaborative_recommendations(self, fingerprint: Dict[str, Any], 
-                                         limit: int) -> List[Dict[str, Any]]:
+                                         limit: int,
+                                         firmware_index: Optional[Dict[str, Dict[str, Any]]] = None
+                                         ) -> List[Dict[str, Any]]:
         """Get collaborative filtering recommendations"""
         recommendations = []
         
@@ -566,8 +925,12 @@ class FirmwareRecommendationEngine:
             similar_devices = cursor.fetchall()
             conn.close()
             
+            # Resolve ids against one firmware list fetch, skipped when nothing matched
+            if similar_devices and firmware_index is None:
+                firmware_index = self._build_firmware_index()
+            
             for firmware_id, usage_count in similar_devices:
-                firmware = self._get_firmware_by_id(firmware_id)
+                firmware = self._get_firmware_by_id(firmware_id, firmware_index)
                 if firmware:
                     confidence = min(0.3 + (usage_count * 0.1), 0.8)
                     
@@ -585,25 +948,41 @@ class FirmwareRecommendationEngine:
         return recommendations
     
     def _get_popular_recommendations(self, fingerprint: Dict[str, Any], 
-                                   limit: int) -> List[Dict[str, Any]]:
+                                   limit: int,
+                                   firmware_list: Optional[List[Dict[str, Any]]] = None
+                                   ) -> List[Dict[str, Any]]:
         """Get popular firmware recommendations"""
         recommendations = []
         
         # Get most downloaded firmware for chip type
-        firmware_list = self.firmware_manager.get_firmware_list(
-            chip_type=fingerprint['chip_type'],
-            verified_only=True
-        )
+        if firmware_list is None:
+            firmware_list = self.firmware_manager.get_firmware_list(
+                chip_type=fingerprint['chip_type'],
+                verified_only=True
+            )
         
-        # Sort by download count
-        popular_firmware = sorted(
-            firmware_list, 
-            key=lambda x: x.get('total_downloads', 0), 
-            reverse=True
+        count = min(limit, len(firmware_list))
+        if count <= 0:
+            return recommendations
+        
+        downloads = np.fromiter(
+            (firmware.get('total_downloads', 0) or 0 for firmware in firmware_list),
+            dtype=np.int64, count=len(firmware_list)
         )
         
-        for firmware in popular_firmware[:limit]:
-            confidence = 0.2 + min(firmware.get('total_downloads', 0) / 10000, 0.3)
+        # Top `limit` by download count: argpartition finds the cut-off in O(N), then only
+        # the entries at or above it are stably sorted so ties keep list order
+        if count < len(downloads):
+            threshold = downloads[np.argpartition(-downloads, count - 1)[count - 1]]
+            candidates = np.flatnonzero(downloads >= threshold)
+        else:
+            candidates = np.arange(len(downloads))
+        top = candidates[np.argsort(-downloads[candidates], kind='stable')][:count]
+        
+        confidences = 0.2 + np.minimum(downloads[top] / 10000, 0.3)
+        
+        for index, confidence in zip(top.tolist(), confidences.tolist()):
+            firmware = firmware_list[index]
             
             recommendations.append({
                 'firmware_id': firmware['id'],
@@ -615,13 +994,17 @@ class FirmwareRecommendationEngine:
         
         return recommendations
     
-    def _get_firmware_by_id(self, firmware_id: str) -> Optional[Dict[str, Any]]:
+    def _build_firmware_index(self) -> Dict[str, Dict[str, Any]]:
+        """Map firmware id to firmware details from a single list fetch"""
+        return {firmware['id']: firmware for firmware in self.firmware_manager.get_firmware_list()}
+    
+    def _get_firmware_by_id(self, firmware_id: str,
+                            firmware_index: Optional[Dict[str, Dict[str, Any]]] = None
+                            ) -> Optional[Dict[str, Any]]:
         """Get firmware details by ID"""
-        firmware_list = self.firmware_manager.get_firmware_list()
-        for firmware in firmware_list:
-            if firmware['id'] == firmware_id:
-                return firmware
-        return None
+        if firmware_index is None:
+            firmware_index = self._build_firmware_index()
+        return firmware_index.get(firmware_id)
     
     def record_recommendation_feedback(self, device_fingerprint: str, 
                                      recommended_firmware: str,
@@ -112,6 +112,7 @@ class FirmwareManager:
                     FOREIGN KEY (firmware_id) REFERENCES firmware (id)
                 )
             ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fd_downloaded ON firmware_downloads(downloaded_at, firmware_id)')
             
             # User ratings
             cursor.execute('''
@@ -1,20 +1,368 @@
-import json
+import atexit
 import logging
 import os
 import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+
+from utils.json_codec import dumps as _dumps, loads as _loads
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional, JSON text is used without it
+    msgpack = None
 
 logger = logging.getLogger(__name__)
 
+# Structured columns stored as MessagePack BLOBs (tags stays JSON text for search)
+PACKED_COLUMNS = ('template_data', 'gpio_config', 'rules', 'settings')
+
+def _pack(obj: Any) -> Union[bytes, str]:
+    """Encode a structured column: MessagePack BLOB when available, JSON text otherwise"""
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return _dumps(obj)
+
+def _unpack(value: Union[bytes, str]) -> Any:
+    """Decode a structured column written as a MessagePack BLOB or as JSON text"""
+    if isinstance(value, bytes):
+        if msgpack is None:
+            raise RuntimeError("msgpack is required to read packed template columns")
+        return msgpack.unpackb(value, raw=False)
+    return _loads(value)
+
+# Column order shared by every full template SELECT
+TEMPLATE_COLUMNS = (
+    'id', 'name', 'description', 'category', 'manufacturer', 'model',
+    'template_data', 'gpio_config', 'rules', 'settings', 'image_url',
+    'author', 'version', 'tags', 'public', 'downloads', 'rating',
+    'created_at', 'updated_at'
+)
+
+# Encoded columns as (name, row index, decoder, factory for the empty default),
+# resolved once here so hydration does no per-row name or index lookups
+DECODED_COLUMNS = tuple(
+    (column, TEMPLATE_COLUMNS.index(column), decode, default)
+    for column, decode, default in (
+        ('template_data', _unpack, dict),
+        ('gpio_config', _unpack, dict),
+        ('rules', _unpack, list),
+        ('settings', _unpack, dict),
+        ('tags', _loads, list),
+    )
+)
+
+PUBLIC_INDEX = TEMPLATE_COLUMNS.index('public')
+
+# Rows pulled per fetchmany() call when streaming template listings
+FETCH_BATCH_SIZE = 256
+
+# Hydrated templates kept in memory by get_template, least recently used evicted first
+TEMPLATE_CACHE_SIZE = 128
+
+def _row_to_dict(row: tuple) -> Dict[str, Any]:
+    """Hydrate a full template row selected in TEMPLATE_COLUMNS order"""
+    template = dict(zip(TEMPLATE_COLUMNS, row))
+    for column, index, decode, default in DECODED_COLUMNS:
+        value = row[index]
+        template[column] = decode(value) if value else default()
+    template['public'] = bool(row[PUBLIC_INDEX])
+    return template
+
+# Cheap columns for list views; the encoded structured columns are never read
+SUMMARY_COLUMNS = (
+    'id', 'name', 'description', 'category', 'manufacturer', 'model',
+    'image_url', 'author', 'version', 'public', 'downloads', 'rating',
+    'created_at', 'updated_at'
+)
+
+SUMMARY_PUBLIC_INDEX = SUMMARY_COLUMNS.index('public')
+
+def _summary_to_dict(row: tuple) -> Dict[str, Any]:
+    """Build a template summary from a row selected in SUMMARY_COLUMNS order"""
+    template = dict(zip(SUMMARY_COLUMNS, row))
+    template['public'] = bool(row[SUMMARY_PUBLIC_INDEX])
+    return template
+
+# Tasmota template GPIO arrays: up to 36 pins (ESP32), 16-bit component codes
+GPIO_MAX_PINS = 36
+GPIO_CODE_MAX = 0xFFFF
+
+def _gpio_to_np(gpio: Any) -> np.ndarray:
+    """Convert a template GPIO list to a uint16 array, raising ValueError if it is malformed"""
+    arr = np.asarray(gpio)
+    if arr.size == 0:
+        return np.zeros(0, dtype=np.uint16)
+    if arr.ndim != 1 or arr.dtype.kind not in 'iu':
+        raise ValueError("GPIO must be a flat list of integers")
+    if arr.size > GPIO_MAX_PINS:
+        raise ValueError(f"GPIO has {arr.size} entries, at most {GPIO_MAX_PINS} are allowed")
+    if np.any((arr < 0) | (arr > GPIO_CODE_MAX)):
+        raise ValueError(f"GPIO codes must be between 0 and {GPIO_CODE_MAX}")
+    return arr.astype(np.uint16)
+
+def _gpio_equal(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Whether two templates configure the same GPIO array"""
+    return np.array_equal(_gpio_to_np(a.get('template_data', {}).get('GPIO', [])),
+                          _gpio_to_np(b.get('template_data', {}).get('GPIO', [])))
+
+# Hot-path statements, kept as constants so each call hits the connection's statement cache
+SELECT_TEMPLATE_SQL = '''
+    SELECT id, name, description, category, manufacturer, model,
+           template_data, gpio_config, rules, settings, image_url,
+           author, version, tags, public, downloads, rating,
+           created_at, updated_at
+    FROM templates
+    WHERE id = ?
+'''
+
+# Primary-key lookup used to validate cached templates without decoding anything
+SELECT_TEMPLATE_UPDATED_AT_SQL = 'SELECT updated_at FROM templates WHERE id = ?'
+
+INSERT_TEMPLATE_SQL = f'''
+    INSERT INTO templates
+    ({', '.join(TEMPLATE_COLUMNS)})
+    VALUES ({', '.join('?' * len(TEMPLATE_COLUMNS))})
+'''
+
+# Updates in place rather than REPLACE, which would delete the row and cascade to its ratings
+UPSERT_TEMPLATE_SQL = INSERT_TEMPLATE_SQL + f'''
+    ON CONFLICT(id) DO UPDATE SET
+    {', '.join(f"{column} = excluded.{column}" for column in TEMPLATE_COLUMNS[1:])}
+'''
+
+# Same columns as UPSERT_TEMPLATE_SQL, but leaves existing rows untouched
+INSERT_TEMPLATE_IF_MISSING_SQL = INSERT_TEMPLATE_SQL.replace('INSERT INTO', 'INSERT OR IGNORE INTO')
+
+DELETE_TEMPLATE_SQL = 'DELETE FROM templates WHERE id = ?'
+
+LIST_TEMPLATES_SQL = f'''
+    SELECT {', '.join(SUMMARY_COLUMNS)}
+    FROM templates
+    ORDER BY category, manufacturer, name
+'''
+
+LIST_TEMPLATES_FULL_SQL = f'''
+    SELECT {', '.join(TEMPLATE_COLUMNS)}
+    FROM templates
+    ORDER BY category, manufacturer, name
+'''
+
+INCREMENT_DOWNLOADS_SQL = 'UPDATE templates SET downloads = downloads + ? WHERE id = ?'
+
+# Built-in device templates, seeded into the database on startup
+BUILTIN_TEMPLATES = (
+    {
+        'id': 'sonoff_basic',
+        'name': 'Sonoff Basic R2',
+        'description': 'Basic WiFi smart switch with relay',
+        'category': 'Switch',
+        'manufacturer': 'Sonoff',
+        'model': 'Basic R2',
+        'template_data': {
+            'NAME': 'Sonoff Basic',
+            'GPIO': [17, 255, 255, 255, 255, 0, 255, 255, 21, 56, 255, 255, 255],
+            'FLAG': 0,
+            'BASE': 1
+        },
+        'gpio_config': {
+            'GPIO0': 'Button1',
+            'GPIO12': 'Relay1',
+            'GPIO13': 'Led1i'
+        },
+        'settings': {
+            'SetOption73': '1',  # Button decoupling
+            'LedState': '1'      # LED follows relay
+        }
+    },
+    {
+        'id': 'sonoff_s20',
+        'name': 'Sonoff S20',
+        'description': 'Smart plug with relay and LED',
+        'category': 'Plug',
+        'manufacturer': 'Sonoff',
+        'model': 'S20',
+        'template_data': {
+            'NAME': 'Sonoff S20',
+            'GPIO': [17, 255, 255, 255, 255, 0, 255, 255, 21, 56, 255, 255, 255],
+            'FLAG': 0,
+            'BASE': 1
+        },
+        'gpio_config': {
+            'GPIO0': 'Button1',
+            'GPIO12': 'Relay1',
+            'GPIO13': 'Led1i'
+        }
+    },
+    {
+        'id': 'wemos_d1_mini',
+        'name': 'Wemos D1 Mini',
+        'description': 'Generic ESP8266 development board',
+        'category': 'Development',
+        'manufacturer': 'Wemos',
+        'model': 'D1 Mini',
+        'template_data': {
+            'NAME': 'WeMos D1 mini',
+            'GPIO': [255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255],
+            'FLAG': 0,
+            'BASE': 18
+        },
+        'gpio_config': {
+            'D0': 'GPIO16',
+            'D1': 'GPIO5',
+            'D2': 'GPIO4',
+            'D3': 'GPIO0',
+            'D4': 'GPIO2',
+            'D5': 'GPIO14',
+            'D6': 'GPIO12',
+            'D7': 'GPIO13',
+            'D8': 'GPIO15'
+        }
+    },
+    {
+        'id': 'esp32_devkit',
+        'name': 'ESP32 DevKit',
+        'description': 'Generic ESP32 development board',
+        'category': 'Development',
+        'manufacturer': 'Espressif',
+        'model': 'ESP32',
+        'template_data': {
+            'NAME': 'ESP32-DevKit',
+            'GPIO': [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+            'FLAG': 0,
+            'BASE': 1
+        },
+        'gpio_config': {
+            'GPIO2': 'User',
+            'GPIO4': 'User',
+            'GPIO5': 'User'
+        }
+    }
+)
+
+
+def _template_row(template_data: Dict[str, Any],
+                  pre_serialized: Optional[Dict[str, Union[bytes, str]]] = None,
+                  now: Optional[str] = None) -> tuple:
+    """Bound parameters for UPSERT_TEMPLATE_SQL / INSERT_TEMPLATE_IF_MISSING_SQL
+    
+    pre_serialized maps packed column names to values the caller already encoded
+    with _pack, so they are stored as-is instead of being encoded a second time.
+    now is the ISO timestamp used for missing created_at/updated_at values.
+    """
+    encoded = pre_serialized or {}
+    if now is None:
+        now = datetime.now().isoformat()
+    
+    def packed(column: str, default: Any) -> Union[bytes, str]:
+        if column in encoded:
+            return encoded[column]
+        return _pack(template_data.get(column, default))
+    
+    return (
+        template_data['id'],
+        template_data.get('name', ''),
+        template_data.get('description', ''),
+        template_data.get('category', ''),
+        template_data.get('manufacturer', ''),
+        template_data.get('model', ''),
+        packed('template_data', {}),
+        packed('gpio_config', {}),
+        packed('rules', []),
+        packed('settings', {}),
+        template_data.get('image_url', ''),
+        template_data.get('author', ''),
+        template_data.get('version', '1.0'),
+        _dumps(template_data.get('tags', [])),
+        template_data.get('public', False),
+        template_data.get('downloads', 0),
+        template_data.get('rating', 0.0),
+        template_data.get('created_at', now),
+        template_data.get('updated_at', now)
+    )
+
+
+# Rows are built once at import; startup only filters out ids already stored
+BUILTIN_TEMPLATE_ROWS = {row[0]: row for row in map(_template_row, BUILTIN_TEMPLATES)}
+
+SELECT_BUILTIN_IDS_SQL = f"SELECT id FROM templates WHERE id IN ({','.join('?' * len(BUILTIN_TEMPLATE_ROWS))})"
+
+# Tasmota runs at most 30 commands per Backlog and drops input past its command buffer
+BACKLOG_MAX_COMMANDS = 30
+BACKLOG_MAX_LENGTH = 700
+
+def _backlog_batches(commands: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """Group (command, value) pairs into in-order Backlog batches within Tasmota's limits"""
+    batches = []
+    batch: List[Tuple[str, str]] = []
+    length = 0
+    for command, value in commands:
+        entry_length = len(command) + len(value) + 3
+        # Backlog splits on ';', so values that contain one are sent on their own
+        if ';' in value or entry_length > BACKLOG_MAX_LENGTH:
+            if batch:
+                batches.append(batch)
+                batch, length = [], 0
+            batches.append([(command, value)])
+            continue
+        if batch and (len(batch) == BACKLOG_MAX_COMMANDS or length + entry_length > BACKLOG_MAX_LENGTH):
+            batches.append(batch)
+            batch, length = [], 0
+        batch.append((command, value))
+        length += entry_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class TemplateManager:
     """Manages device templates for Tasmota devices"""
     
-    def __init__(self):
-        self.db_path = '/opt/app/data/templates.db'
-        self.templates_dir = '/opt/app/data/templates'
+    def __init__(self, device_manager=None, db_path: str = '/opt/app/data/templates.db',
+                 templates_dir: str = '/opt/app/data/templates'):
+        # Shared DeviceManager used by apply_template to reach devices
+        self.device_manager = device_manager
+        self.db_path = db_path
+        self.templates_dir = templates_dir
+        # One connection per thread, opened lazily and reused across calls
+        self._local = threading.local()
+        # Set once the trigram FTS index exists; search falls back to LIKE otherwise
+        self._fts_enabled = False
+        # template id -> (updated_at, hydrated template), validated on every get_template
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
         self._init_database()
         self._load_builtin_templates()
+        
+        # Download counts are coalesced in memory and written in batches by a flush thread
+        self._pending_downloads = Counter()
+        self._downloads_lock = threading.Lock()
+        self.downloads_flush_interval = 5.0
+        self.downloads_thread = threading.Thread(target=self._downloads_flush_loop)
+        self.downloads_thread.daemon = True
+        self.downloads_thread.start()
+        atexit.register(self._flush_downloads)
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's database connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            # journal_mode is persistent and set once in _init_database; these are per connection
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-8000')
+            conn.execute('PRAGMA mmap_size=134217728')
+            conn.execute('PRAGMA wal_autocheckpoint=1000')
+            # template_ratings rows are removed with their template by ON DELETE CASCADE
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
     
     def _init_database(self):
         """Initialize SQLite database for template storage"""
@@ -22,7 +370,14 @@ class TemplateManager:
             os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
             os.makedirs(self.templates_dir, exist_ok=True)
             
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
+            
+            # Readers keep going while a write commits; stored in the file, so this flips
+            # an existing rollback-journal database once and is a no-op afterwards
+            journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                logger.warning(f"Template database stays in {journal_mode} journal mode")
+            
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -57,216 +412,256 @@ class TemplateManager:
                     rating INTEGER,
                     comment TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (template_id) REFERENCES templates (id)
+                    FOREIGN KEY (template_id) REFERENCES templates (id) ON DELETE CASCADE
                 )
             ''')
             
+            # Index order matches get_all_templates' ORDER BY, so no sort step
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_templates_cat_mfr_name
+                ON templates(category, manufacturer, name)
+            ''')
+            
             conn.commit()
-            conn.close()
+            self._cascade_template_ratings(conn)
+            self._pack_json_columns(conn)
+            self._init_search_index(conn)
             logger.info("Template database initialized")
         except Exception as e:
             logger.error(f"Template database initialization error: {e}")
     
+    def _cascade_template_ratings(self, conn: sqlite3.Connection):
+        """One-shot rebuild of template_ratings created before its foreign key cascaded"""
+        try:
+            on_delete = {row[6] for row in conn.execute('PRAGMA foreign_key_list(template_ratings)')}
+            if on_delete == {'CASCADE'}:
+                return
+            
+            # SQLite cannot alter a foreign key, so copy into a new table; ratings whose
+            # template is already gone would violate the key and are dropped
+            with conn:
+                conn.execute('''
+                    CREATE TABLE template_ratings_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        template_id TEXT,
+                        user_id TEXT,
+                        rating INTEGER,
+                        comment TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (template_id) REFERENCES templates (id) ON DELETE CASCADE
+                    )
+                ''')
+                conn.execute('''
+                    INSERT INTO template_ratings_new
+                    SELECT * FROM template_ratings
+                    WHERE template_id IS NULL OR template_id IN (SELECT id FROM templates)
+                ''')
+                conn.execute('DROP TABLE template_ratings')
+                conn.execute('ALTER TABLE template_ratings_new RENAME TO template_ratings')
+            logger.info("Rebuilt template_ratings with ON DELETE CASCADE")
+        except Exception as e:
+            logger.error(f"Error migrating template_ratings foreign key: {e}")
+    
+    def _pack_json_columns(self, conn: sqlite3.Connection):
+        """One-shot migration of JSON-text structured columns to MessagePack BLOBs"""
+        if msgpack is None:
+            return
+        try:
+            rows = conn.execute(f'''
+                SELECT rowid, {', '.join(PACKED_COLUMNS)} FROM templates
+                WHERE {' OR '.join(f"typeof({column}) = 'text'" for column in PACKED_COLUMNS)}
+            ''').fetchall()
+            if not rows:
+                return
+            
+            updates = [
+                tuple(_pack(_unpack(value)) if value else value for value in row[1:]) + (row[0],)
+                for row in rows
+            ]
+            with conn:
+                conn.executemany(f'''
+                    UPDATE templates SET {', '.join(f"{column} = ?" for column in PACKED_COLUMNS)}
+                    WHERE rowid = ?
+                ''', updates)
+            logger.info(f"Packed {len(updates)} templates to MessagePack")
+        except Exception as e:
+            logger.error(f"Template MessagePack migration error: {e}")
+    
+    def _init_search_index(self, conn: sqlite3.Connection):
+        """Create the trigram FTS5 index used by search_templates, if SQLite supports it"""
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'templates_fts'"
+            ).fetchone()
+            
+            with conn:
+                # trigram keeps the substring semantics of the old LIKE '%q%' search
+                conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS templates_fts USING fts5(
+                        name, description, tags,
+                        content='templates', content_rowid='rowid', tokenize='trigram'
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS templates_fts_ai AFTER INSERT ON templates BEGIN
+                        INSERT INTO templates_fts(rowid, name, description, tags)
+                        VALUES (new.rowid, new.name, new.description, new.tags);
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS templates_fts_ad AFTER DELETE ON templates BEGIN
+                        INSERT INTO templates_fts(templates_fts, rowid, name, description, tags)
+                        VALUES ('delete', old.rowid, old.name, old.description, old.tags);
+                    END
+                ''')
+                # Only the indexed columns reindex; downloads/rating bumps leave FTS alone.
+                # Databases created before that carry a plain AFTER UPDATE trigger: replace it
+                au_sql = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'templates_fts_au'"
+                ).fetchone()
+                if au_sql and 'UPDATE OF' not in au_sql[0]:
+                    conn.execute('DROP TRIGGER templates_fts_au')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS templates_fts_au
+                    AFTER UPDATE OF name, description, tags ON templates BEGIN
+                        INSERT INTO templates_fts(templates_fts, rowid, name, description, tags)
+                        VALUES ('delete', old.rowid, old.name, old.description, old.tags);
+                        INSERT INTO templates_fts(rowid, name, description, tags)
+                        VALUES (new.rowid, new.name, new.description, new.tags);
+                    END
+                ''')
+                if not exists:
+                    conn.execute("INSERT INTO templates_fts(templates_fts) VALUES ('rebuild')")
+            
+            self._fts_enabled = True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+            logger.warning(f"Template full-text search unavailable, using LIKE: {e}")
+    
     def _load_builtin_templates(self):
         """Load built-in device templates"""
-        builtin_templates = [
-            {
-                'id': 'sonoff_basic',
-                'name': 'Sonoff Basic R2',
-                'description': 'Basic WiFi smart switch with relay',
-                'category': 'Switch',
-                'manufacturer': 'Sonoff',
-                'model': 'Basic R2',
-                'template_data': {
-                    'NAME': 'Sonoff Basic',
-                    'GPIO': [17, 255, 255, 255, 255, 0, 255, 255, 21, 56, 255, 255, 255],
-                    'FLAG': 0,
-                    'BASE': 1
-                },
-                'gpio_config': {
-                    'GPIO0': 'Button1',
-                    'GPIO12': 'Relay1',
-                    'GPIO13': 'Led1i'
-                },
-                'settings': {
-                    'SetOption73': '1',  # Button decoupling
-                    'LedState': '1'      # LED follows relay
-                }
-            },
-            {
-                'id': 'sonoff_s20',
-                'name': 'Sonoff S20',
-                'description': 'Smart plug with relay and LED',
-                'category': 'Plug',
-                'manufacturer': 'Sonoff',
-                'model': 'S20',
-                'template_data': {
-                    'NAME': 'Sonoff S20',
-                    'GPIO': [17, 255, 255, 255, 255, 0, 255, 255, 21, 56, 255, 255, 255],
-                    'FLAG': 0,
-                    'BASE': 1
-                },
-                'gpio_config': {
-                    'GPIO0': 'Button1',
-                    'GPIO12': 'Relay1',
-                    'GPIO13': 'Led1i'
-                }
-            },
-            {
-                'id': 'wemos_d1_mini',
-                'name': 'Wemos D1 Mini',
-                'description': 'Generic ESP8266 development board',
-                'category': 'Development',
-                'manufacturer': 'Wemos',
-                'model': 'D1 Mini',
-                'template_data': {
-                    'NAME': 'WeMos D1 mini',
-                    'GPIO': [255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255],
-                    'FLAG': 0,
-                    'BASE': 18
-                },
-                'gpio_config': {
-                    'D0': 'GPIO16',
-                    'D1': 'GPIO5',
-                    'D2': 'GPIO4',
-                    'D3': 'GPIO0',
-                    'D4': 'GPIO2',
-                    'D5': 'GPIO14',
-                    'D6': 'GPIO12',
-                    'D7': 'GPIO13',
-                    'D8': 'GPIO15'
-                }
-            },
-            {
-                'id': 'esp32_devkit',
-                'name': 'ESP32 DevKit',
-                'description': 'Generic ESP32 development board',
-                'category': 'Development',
-                'manufacturer': 'Espressif',
-                'model': 'ESP32',
-                'template_data': {
-                    'NAME': 'ESP32-DevKit',
-                    'GPIO': [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
-                    'FLAG': 0,
-                    'BASE': 1
-                },
-                'gpio_config': {
-                    'GPIO2': 'User',
-                    'GPIO4': 'User',
-                    'GPIO5': 'User'
-                }
-            }
-        ]
-        
-        # Insert built-in templates if they don't exist
-        for template in builtin_templates:
-            existing = self.get_template(template['id'])
-            if not existing:
-                self._save_template_to_db(template)
-                logger.info(f"Loaded built-in template: {template['name']}")
+        # Insert built-in templates if they don't exist, in one transaction
+        try:
+            conn = self._conn()
+            
+            # One probe for all ids; the usual restart finds them all and writes nothing
+            existing = {row[0] for row in conn.execute(SELECT_BUILTIN_IDS_SQL, tuple(BUILTIN_TEMPLATE_ROWS))}
+            missing = [row for template_id, row in BUILTIN_TEMPLATE_ROWS.items() if template_id not in existing]
+            if not missing:
+                return
+            
+            with conn:
+                # rowcount counts only inserted templates, not FTS trigger writes
+                loaded = conn.executemany(INSERT_TEMPLATE_IF_MISSING_SQL, missing).rowcount
+            if loaded:
+                logger.info(f"Loaded {loaded} built-in templates")
+        except Exception as e:
+            logger.error(f"Error loading built-in templates: {e}")
     
-    def get_all_templates(self) -> List[Dict[str, Any]]:
-        """Get all templates"""
+    def get_all_templates(self, full: bool = True) -> List[Dict[str, Any]]:
+        """Get all templates; full=False returns summaries (see list_templates)"""
+        if not full:
+            return self.list_templates()
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
-            cursor.execute('''
-                SELECT id, name, description, category, manufacturer, model,
-                       template_data, gpio_config, rules, settings, image_url,
-                       author, version, tags, public, downloads, rating,
-                       created_at, updated_at
-                FROM templates
-                ORDER BY category, manufacturer, name
-            ''')
+            cursor.execute(LIST_TEMPLATES_FULL_SQL)
             
+            # Full listings are serialized straight away, so decode eagerly
             templates = []
-            for row in cursor.fetchall():
-                template = {
-                    'id': row[0],
-                    'name': row[1],
-                    'description': row[2],
-                    'category': row[3],
-                    'manufacturer': row[4],
-                    'model': row[5],
-                    'template_data': json.loads(row[6]) if row[6] else {},
-                    'gpio_config': json.loads(row[7]) if row[7] else {},
-                    'rules': json.loads(row[8]) if row[8] else [],
-                    'settings': json.loads(row[9]) if row[9] else {},
-                    'image_url': row[10],
-                    'author': row[11],
-                    'version': row[12],
-                    'tags': json.loads(row[13]) if row[13] else [],
-                    'public': bool(row[14]),
-                    'downloads': row[15],
-                    'rating': row[16],
-                    'created_at': row[17],
-                    'updated_at': row[18]
-                }
-                templates.append(template)
-            
-            conn.close()
+            while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+                templates.extend(map(_row_to_dict, rows))
+            
             return templates
         except Exception as e:
             logger.error(f"Error getting templates: {e}")
             return []
     
+    def list_templates(self) -> List[Dict[str, Any]]:
+        """Get template summaries without the structured template columns"""
+        try:
+            cursor = self._conn().cursor()
+            
+            cursor.execute(LIST_TEMPLATES_SQL)
+            
+            templates = []
+            while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+                templates.extend(map(_summary_to_dict, rows))
+            
+            return templates
+        except Exception as e:
+            logger.error(f"Error listing templates: {e}")
+            return []
+    
     def get_template(self, template_id: str) -> Optional[Dict[str, Any]]:
         """Get specific template by ID"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, name, description, category, manufacturer, model,
-                       template_data, gpio_config, rules, settings, image_url,
-                       author, version, tags, public, downloads, rating,
-                       created_at, updated_at
-                FROM templates
-                WHERE id = ?
-            ''', (template_id,))
-            
-            row = cursor.fetchone()
-            if row:
-                template = {
-                    'id': row[0],
-                    'name': row[1],
-                    'description': row[2],
-                    'category': row[3],
-                    'manufacturer': row[4],
-                    'model': row[5],
-                    'template_data': json.loads(row[6]) if row[6] else {},
-                    'gpio_config': json.loads(row[7]) if row[7] else {},
-                    'rules': json.loads(row[8]) if row[8] else [],
-                    'settings': json.loads(row[9]) if row[9] else {},
-                    'image_url': row[10],
-                    'author': row[11],
-                    'version': row[12],
-                    'tags': json.loads(row[13]) if row[13] else [],
-                    'public': bool(row[14]),
-                    'downloads': row[15],
-                    'rating': row[16],
-                    'created_at': row[17],
-                    'updated_at': row[18]
-                }
-                conn.close()
-                return template
-            
-            conn.close()
-            return None
+            conn = self._conn()
+            
+            # Cheap index probe first; the full SELECT and decode only run on a miss
+            row = conn.execute(SELECT_TEMPLATE_UPDATED_AT_SQL, (template_id,)).fetchone()
+            if not row:
+                self._invalidate_template(template_id)
+                return None
+            updated_at = row[0]
+            
+            with self._cache_lock:
+                cached = self._cache.get(template_id)
+                if cached and cached[0] == updated_at:
+                    self._cache.move_to_end(template_id)
+                    return dict(cached[1])
+            
+            row = conn.execute(SELECT_TEMPLATE_SQL, (template_id,)).fetchone()
+            if not row:
+                return None
+            
+            template = _row_to_dict(row)
+            with self._cache_lock:
+                self._cache[template_id] = (template['updated_at'], template)
+                self._cache.move_to_end(template_id)
+                if len(self._cache) > TEMPLATE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            return dict(template)
         except Exception as e:
             logger.error(f"Error getting template {template_id}: {e}")
             return None
     
+    def _invalidate_template(self, template_id: str):
+        """Drop a template from the get_template cache"""
+        with self._cache_lock:
+            self._cache.pop(template_id, None)
+    
+    def validate_template(self, template_data: Dict[str, Any]) -> List[str]:
+        """Check a template's device data, returning a list of problems (empty if valid)"""
+        errors = []
+        device_data = template_data.get('template_data') or {}
+        if not isinstance(device_data, dict):
+            return ["template_data must be an object"]
+        
+        if 'GPIO' in device_data:
+            try:
+                _gpio_to_np(device_data['GPIO'])
+            except ValueError as e:
+                errors.append(str(e))
+        
+        return errors
+    
     def create_template(self, template_data: Dict[str, Any]) -> str:
         """Create new template"""
         try:
-            template_id = template_data.get('id') or f"custom_{int(datetime.now().timestamp())}"
+            errors = self.validate_template(template_data)
+            if errors:
+                raise ValueError(f"Invalid template: {'; '.join(errors)}")
+            
+            created = datetime.now()
+            now = created.isoformat()
+            template_id = template_data.get('id') or f"custom_{int(created.timestamp())}"
             template_data['id'] = template_id
-            template_data['created_at'] = datetime.now().isoformat()
-            template_data['updated_at'] = datetime.now().isoformat()
+            template_data['created_at'] = now
+            template_data['updated_at'] = now
             
-            self._save_template_to_db(template_data)
+            self._save_template_to_db(template_data, now=now)
             logger.info(f"Created template: {template_id}")
             return template_id
         except Exception as e:
@@ -276,39 +671,41 @@ class TemplateManager:
     def update_template(self, template_id: str, template_data: Dict[str, Any]) -> bool:
         """Update existing template"""
         try:
-            template_data['updated_at'] = datetime.now().isoformat()
+            errors = self.validate_template(template_data)
+            if errors:
+                raise ValueError(f"Invalid template: {'; '.join(errors)}")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            template_data['updated_at'] = datetime.now().isoformat()
             
-            cursor.execute('''
-                UPDATE templates SET
-                    name = ?, description = ?, category = ?, manufacturer = ?,
-                    model = ?, template_data = ?, gpio_config = ?, rules = ?,
-                    settings = ?, image_url = ?, author = ?, version = ?,
-                    tags = ?, updated_at = ?
-                WHERE id = ?
-            ''', (
-                template_data.get('name', ''),
-                template_data.get('description', ''),
-                template_data.get('category', ''),
-                template_data.get('manufacturer', ''),
-                template_data.get('model', ''),
-                json.dumps(template_data.get('template_data', {})),
-                json.dumps(template_data.get('gpio_config', {})),
-                json.dumps(template_data.get('rules', [])),
-                json.dumps(template_data.get('settings', {})),
-                template_data.get('image_url', ''),
-                template_data.get('author', ''),
-                template_data.get('version', ''),
-                json.dumps(template_data.get('tags', [])),
-                template_data['updated_at'],
-                template_id
-            ))
+            conn = self._conn()
+            with conn:
+                cursor = conn.execute('''
+                    UPDATE templates SET
+                        name = ?, description = ?, category = ?, manufacturer = ?,
+                        model = ?, template_data = ?, gpio_config = ?, rules = ?,
+                        settings = ?, image_url = ?, author = ?, version = ?,
+                        tags = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (
+                    template_data.get('name', ''),
+                    template_data.get('description', ''),
+                    template_data.get('category', ''),
+                    template_data.get('manufacturer', ''),
+                    template_data.get('model', ''),
+                    _pack(template_data.get('template_data', {})),
+                    _pack(template_data.get('gpio_config', {})),
+                    _pack(template_data.get('rules', [])),
+                    _pack(template_data.get('settings', {})),
+                    template_data.get('image_url', ''),
+                    template_data.get('author', ''),
+                    template_data.get('version', ''),
+                    _dumps(template_data.get('tags', [])),
+                    template_data['updated_at'],
+                    template_id
+                ))
+            self._invalidate_template(template_id)
             
-            conn.commit()
             success = cursor.rowcount > 0
-            conn.close()
             
             if success:
                 logger.info(f"Updated template: {template_id}")
@@ -320,15 +717,12 @@ class TemplateManager:
     def delete_template(self, template_id: str) -> bool:
         """Delete template"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM templates WHERE id = ?', (template_id,))
-            cursor.execute('DELETE FROM template_ratings WHERE template_id = ?', (template_id,))
+            conn = self._conn()
+            with conn:
+                cursor = conn.execute(DELETE_TEMPLATE_SQL, (template_id,))
+            self._invalidate_template(template_id)
             
-            conn.commit()
             success = cursor.rowcount > 0
-            conn.close()
             
             if success:
                 logger.info(f"Deleted template: {template_id}")
@@ -344,37 +738,42 @@ class TemplateManager:
             if not template:
                 raise ValueError(f"Template {template_id} not found")
             
-            # Get device manager to send commands
-            from .device_manager import DeviceManager
-            device_manager = DeviceManager(None)  # This will be injected properly
+            # Send commands through the application's device manager
+            device_manager = self.device_manager
+            if device_manager is None:
+                raise ValueError("No device manager available to apply templates")
             device = device_manager.get_device(device_id)
             
             if not device:
                 raise ValueError(f"Device {device_id} not found")
             
-            results = []
+            commands = []
             
             # Apply template
             if template['template_data']:
-                template_json = json.dumps(template['template_data'])
-                result = device_manager.send_command(device_id, 'Template', template_json)
-                results.append({'command': 'Template', 'result': result})
+                template_json = _dumps(template['template_data'])
+                commands.append(('Template', template_json))
             
             # Apply settings
             if template.get('settings'):
-                for setting, value in template['settings'].items():
-                    result = device_manager.send_command(device_id, setting, str(value))
-                    results.append({'command': setting, 'result': result})
+                commands.extend((setting, str(value)) for setting, value in template['settings'].items())
             
             # Apply rules
             if template.get('rules'):
-                for i, rule in enumerate(template['rules'], 1):
-                    result = device_manager.send_command(device_id, f'Rule{i}', rule)
-                    results.append({'command': f'Rule{i}', 'result': result})
+                commands.extend((f'Rule{i}', rule) for i, rule in enumerate(template['rules'], 1))
             
             # Restart device to apply changes
-            restart_result = device_manager.send_command(device_id, 'Restart', '1')
-            results.append({'command': 'Restart', 'result': restart_result})
+            commands.append(('Restart', '1'))
+            
+            # Send the sequence as Backlog commands, one device round-trip per batch
+            results = []
+            for batch in _backlog_batches(commands):
+                if len(batch) == 1:
+                    result = device_manager.send_command(device_id, *batch[0])
+                else:
+                    backlog = '; '.join(f'{command} {value}' for command, value in batch)
+                    result = device_manager.send_command(device_id, 'Backlog', backlog)
+                results.extend({'command': command, 'result': result} for command, _ in batch)
             
             # Update template download count
             self._increment_downloads(template_id)
@@ -393,68 +792,53 @@ class TemplateManager:
                 'error': str(e)
             }
     
-    def _save_template_to_db(self, template_data: Dict[str, Any]):
-        """Save template to database"""
+    def _save_template_to_db(self, template_data: Dict[str, Any],
+                             pre_serialized: Optional[Dict[str, Union[bytes, str]]] = None,
+                             now: Optional[str] = None):
+        """Save template to database, reusing any columns the caller already encoded"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO templates
-                (id, name, description, category, manufacturer, model,
-                 template_data, gpio_config, rules, settings, image_url,
-                 author, version, tags, public, downloads, rating,
-                 created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                template_data['id'],
-                template_data.get('name', ''),
-                template_data.get('description', ''),
-                template_data.get('category', ''),
-                template_data.get('manufacturer', ''),
-                template_data.get('model', ''),
-                json.dumps(template_data.get('template_data', {})),
-                json.dumps(template_data.get('gpio_config', {})),
-                json.dumps(template_data.get('rules', [])),
-                json.dumps(template_data.get('settings', {})),
-                template_data.get('image_url', ''),
-                template_data.get('author', ''),
-                template_data.get('version', '1.0'),
-                json.dumps(template_data.get('tags', [])),
-                template_data.get('public', False),
-                template_data.get('downloads', 0),
-                template_data.get('rating', 0.0),
-                template_data.get('created_at', datetime.now().isoformat()),
-                template_data.get('updated_at', datetime.now().isoformat())
-            ))
-            
-            conn.commit()
-            conn.close()
+            conn = self._conn()
+            with conn:
+                conn.execute(UPSERT_TEMPLATE_SQL, _template_row(template_data, pre_serialized, now))
+            self._invalidate_template(template_data['id'])
         except Exception as e:
             logger.error(f"Error saving template to database: {e}")
             raise
     
     def _increment_downloads(self, template_id: str):
-        """Increment template download count"""
+        """Count a template download; written by the next flush"""
+        with self._downloads_lock:
+            self._pending_downloads[template_id] += 1
+    
+    def _downloads_flush_loop(self):
+        """Flush coalesced download counts every interval"""
+        while True:
+            time.sleep(self.downloads_flush_interval)
+            self._flush_downloads()
+    
+    def _flush_downloads(self):
+        """Write all pending download counts in a single transaction"""
+        with self._downloads_lock:
+            if not self._pending_downloads:
+                return
+            pending = self._pending_downloads
+            self._pending_downloads = Counter()
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE templates SET downloads = downloads + 1
-                WHERE id = ?
-            ''', (template_id,))
-            
-            conn.commit()
-            conn.close()
+            conn = self._conn()
+            with conn:
+                conn.executemany(INCREMENT_DOWNLOADS_SQL,
+                                 [(count, template_id) for template_id, count in pending.items()])
+            # downloads changes without touching updated_at, so cached copies are stale
+            for template_id in pending:
+                self._invalidate_template(template_id)
         except Exception as e:
-            logger.error(f"Error incrementing downloads for {template_id}: {e}")
+            logger.error(f"Error flushing download counts ({len(pending)} templates): {e}")
     
     def search_templates(self, query: str, category: str = None) -> List[Dict[str, Any]]:
         """Search templates by name, description, or tags"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
             sql = '''
                 SELECT id, name, description, category, manufacturer, model,
@@ -462,9 +846,19 @@ class TemplateManager:
                        author, version, tags, public, downloads, rating,
                        created_at, updated_at
                 FROM templates
-                WHERE (name LIKE ? OR description LIKE ? OR tags LIKE ?)
             '''
-            params = [f'%{query}%', f'%{query}%', f'%{query}%']
+            
+            # Trigram MATCH needs at least 3 characters; shorter queries keep the LIKE scan
+            if self._fts_enabled and len(query) >= 3:
+                sql += '''
+                WHERE rowid IN (SELECT rowid FROM templates_fts WHERE templates_fts MATCH ?)
+                '''
+                params = ['"' + query.replace('"', '""') + '"']
+            else:
+                sql += '''
+                WHERE (name LIKE ? OR description LIKE ? OR tags LIKE ?)
+                '''
+                params = [f'%{query}%', f'%{query}%', f'%{query}%']
             
             if category:
                 sql += ' AND category = ?'
@@ -475,31 +869,9 @@ class TemplateManager:
             cursor.execute(sql, params)
             
             templates = []
-            for row in cursor.fetchall():
-                template = {
-                    'id': row[0],
-                    'name': row[1],
-                    'description': row[2],
-                    'category': row[3],
-                    'manufacturer': row[4],
-                    'model': row[5],
-                    'template_data': json.loads(row[6]) if row[6] else {},
-                    'gpio_config': json.loads(row[7]) if row[7] else {},
-                    'rules': json.loads(row[8]) if row[8] else [],
-                    'settings': json.loads(row[9]) if row[9] else {},
-                    'image_url': row[10],
-                    'author': row[11],
-                    'version': row[12],
-                    'tags': json.loads(row[13]) if row[13] else [],
-                    'public': bool(row[14]),
-                    'downloads': row[15],
-                    'rating': row[16],
-                    'created_at': row[17],
-                    'updated_at': row[18]
-                }
-                templates.append(template)
-            
-            conn.close()
+            while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+                templates.extend(map(_row_to_dict, rows))
+            
             return templates
         except Exception as e:
             logger.error(f"Error searching templates: {e}")
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Services import their helpers as top-level packages (utils.*, services.*)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def template_manager(tmp_path):
+    """TemplateManager backed by a database in a temporary directory"""
+    from services.template_manager import TemplateManager
+    
+    manager = TemplateManager(db_path=str(tmp_path / 'templates.db'),
+                              templates_dir=str(tmp_path / 'templates'))
+    yield manager
+    manager._flush_downloads()
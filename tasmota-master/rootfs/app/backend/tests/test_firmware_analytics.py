@@ -0,0 +1,81 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.json_codec import loads
+
+
+def _seed_firmware_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE firmware (id TEXT PRIMARY KEY, variant TEXT, chip_type TEXT);
+        CREATE TABLE firmware_downloads (id INTEGER PRIMARY KEY, firmware_id TEXT, downloaded_at TIMESTAMP);
+        INSERT INTO firmware VALUES ('tasmota', 'tasmota', 'ESP8266');
+    ''')
+    conn.execute("INSERT INTO firmware_downloads (firmware_id, downloaded_at) VALUES ('tasmota', ?)",
+                 (datetime.utcnow().isoformat(sep=' ', timespec='seconds'),))
+    conn.commit()
+    conn.close()
+
+
+def _seed_community_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE community_firmware (
+            id TEXT PRIMARY KEY, name TEXT, chip_type TEXT, status TEXT,
+            download_count INTEGER DEFAULT 0, rating REAL DEFAULT 0.0,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO community_firmware (id, name, chip_type, status, download_count, rating)
+        VALUES ('community_shelly', 'Shelly build', 'ESP32', 'approved', 42, 4.5);
+    ''')
+    conn.close()
+
+
+def test_generate_insights_saves_all_analyzers_in_one_transaction(tmp_path):
+    from services.firmware_analytics import FirmwareAnalyticsEngine
+    
+    firmware_db = str(tmp_path / 'firmware.db')
+    community_db = str(tmp_path / 'community.db')
+    _seed_firmware_db(firmware_db)
+    _seed_community_db(community_db)
+    
+    engine = FirmwareAnalyticsEngine(
+        SimpleNamespace(db_path=firmware_db), SimpleNamespace(db_path=community_db),
+        db_path=str(tmp_path / 'analytics.db'), models_dir=str(tmp_path / 'models')
+    )
+    try:
+        conn = engine._get_conn()
+        with conn:
+            conn.executemany('''
+                INSERT INTO device_usage_patterns (fingerprint_hash, firmware_id, success_rate, issue_count)
+                VALUES (?, ?, ?, ?)
+            ''', [(bytes([i]), 'stable_fw', 0.95, 0) for i in range(3)]
+                 + [(bytes([i]), 'broken_fw', 0.2, 2) for i in range(3)])
+            conn.executemany('''
+                INSERT INTO firmware_compatibility (firmware_id, chip_type, hardware_pattern, compatibility_score)
+                VALUES ('tasmota', 'ESP8266', 'sonoff_basic', 0.3)
+            ''', [()] * 5)
+        
+        statements = []
+        conn.set_trace_callback(statements.append)
+        insights = asyncio.run(engine.generate_analytics_insights())
+        conn.set_trace_callback(None)
+        
+        assert [i['insight_type'] for i in insights] == [
+            'firmware_popularity_trends', 'compatibility_gaps', 'success_patterns', 'community_trends'
+        ]
+        
+        # One BEGIN ... COMMIT around every insight row
+        writes = [s.strip().split()[0].upper() for s in statements
+                  if not s.lstrip().upper().startswith('SELECT')]
+        assert writes == ['BEGIN'] + ['INSERT'] * 4 + ['COMMIT']
+        
+        saved = conn.execute('SELECT insight_type, insight_data FROM analytics_insights').fetchall()
+        assert len(saved) == 4
+        success = loads(dict(saved)['success_patterns'])
+        assert [f['firmware_id'] for f in success['reliable_firmware']] == ['stable_fw']
+        assert [f['firmware_id'] for f in success['problematic_firmware']] == ['broken_fw']
+    finally:
+        engine.close()
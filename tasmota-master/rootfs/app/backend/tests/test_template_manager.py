@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+
+def test_search_results_are_json_serializable(template_manager):
+    template_manager.create_template({
+        'name': 'Kitchen Plug',
+        'description': 'Smart plug with power monitoring',
+        'category': 'plug',
+        'template_data': {'NAME': 'Kitchen Plug', 'GPIO': [0, 56, 0, 17], 'FLAG': 0, 'BASE': 18},
+        'gpio_config': {'0': 'Button1'},
+        'rules': ['ON Power1#State DO Publish stat/plug %value% ENDON'],
+        'settings': {'PowerOnState': 3},
+        'tags': ['plug', 'energy'],
+    })
+    
+    results = template_manager.search_templates('Kitchen')
+    
+    assert [t['name'] for t in results] == ['Kitchen Plug']
+    decoded = json.loads(json.dumps(results))
+    assert decoded[0]['template_data']['GPIO'] == [0, 56, 0, 17]
+    assert decoded[0]['tags'] == ['plug', 'energy']
+
+
+def test_search_index_follows_renames_and_upgrades_old_trigger(tmp_path):
+    from services.template_manager import TemplateManager
+    
+    paths = {'db_path': str(tmp_path / 'templates.db'), 'templates_dir': str(tmp_path / 'templates')}
+    manager = TemplateManager(**paths)
+    if not manager._fts_enabled:
+        pytest.skip('SQLite built without FTS5 trigram support')
+    
+    # Simulate a database from before the column-scoped update trigger
+    conn = manager._conn()
+    with conn:
+        conn.execute('DROP TRIGGER templates_fts_au')
+        conn.execute('''
+            CREATE TRIGGER templates_fts_au AFTER UPDATE ON templates BEGIN
+                INSERT INTO templates_fts(templates_fts, rowid, name, description, tags)
+                VALUES ('delete', old.rowid, old.name, old.description, old.tags);
+                INSERT INTO templates_fts(rowid, name, description, tags)
+                VALUES (new.rowid, new.name, new.description, new.tags);
+            END
+        ''')
+    
+    manager = TemplateManager(**paths)
+    trigger_sql = manager._conn().execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'templates_fts_au'"
+    ).fetchone()[0]
+    assert 'UPDATE OF name, description, tags' in trigger_sql
+    
+    template = {
+        'name': 'Garage Relay',
+        'description': 'Single relay board',
+        'template_data': {'NAME': 'Garage Relay', 'GPIO': [0, 21], 'FLAG': 0, 'BASE': 18},
+    }
+    template_id = manager.create_template(dict(template))
+    assert manager.update_template(template_id, dict(template, name='Porch Relay'))
+    
+    assert [t['id'] for t in manager.search_templates('Porch')] == [template_id]
+    assert manager.search_templates('Garage') == []
+    manager._flush_downloads()
@@ -0,0 +1,44 @@
+"""
+Fast JSON encoding helpers
+Uses orjson when it is installed and falls back to the standard library otherwise
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional accelerator
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> str:
+        """Serialize obj to a compact JSON string"""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize obj to compact JSON bytes"""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    
+    def dumps_sorted(obj: Any) -> str:
+        """Serialize obj to a compact JSON string with sorted keys (stable for fingerprints)"""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS).decode()
+    
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> str:
+        """Serialize obj to a compact JSON string"""
+        return json.dumps(obj, separators=(',', ':'))
+    
+    def dumps_bytes(obj: Any) -> bytes:
+        """Serialize obj to compact JSON bytes"""
+        return json.dumps(obj, separators=(',', ':')).encode()
+    
+    def dumps_sorted(obj: Any) -> str:
+        """Serialize obj to a compact JSON string with sorted keys (stable for fingerprints)"""
+        return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+    
+    def loads(data: Union[str, bytes, bytearray]) -> Any:
+        """Deserialize a JSON document"""
+        return json.loads(data)